@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+from argparse import ArgumentParser, FileType
+from sys import exit, stderr, stdout
+from time import perf_counter
+
+from exceptions import GameError
+from game_state import GameState
+from items import Items
+from moves import Move, outcomes
+from packed_state import PackedPhase
+from parse_log import LogParseError, items_by_name, parse_line, tokenize
+from replay import ITEM_NAMES
+from solver import default_solver
+
+FIELDS = ["file", "line", "phase", "round", "mover", "move", "odds", "best_move", "move_odds", "value_lost"]
+
+
+def played_move(state, words):
+    '''the move a log line makes in state, or None if it isn't one (the line must already have been validated)'''
+    phase = state.phase
+    if phase is None or phase.round is None:
+        return None
+    player_names = list(phase.players)
+    match words:
+        case [player_name, "shoots", target_name, *_]:
+            return Move(target=player_names.index(player_name if target_name == "self" else target_name))
+        case [_, "uses", "jammer", "on", target_name]:
+            return Move(item=Items.JAMMER, on=player_names.index(target_name))
+        case [_, "uses", item_name, *_]:
+            return Move(item=items_by_name[item_name])
+    return None
+
+
+def describe_move(state, move):
+    '''
+    move as a log line would say it, without the mover's name in front or
+    what the shell was ("shoots self", "uses glass", "uses jammer on
+    dealer"), for the player whose turn it is in state (a PackedPhase)
+    '''
+    player_names = state.player_names
+    if move.item is None:
+        return f"shoots {"self" if move.target == state.round.turn else player_names[move.target]}"
+    # items the log format has no name for keep their own
+    item_name = ITEM_NAMES.get(move.item, move.item.name.lower())
+    on = "" if move.on is None else f" on {player_names[move.on]}"
+    if move.stolen:
+        return f"steals {item_name} from {player_names[move.target]}{on}"
+    return f"uses {item_name}{on}"
+
+
+def annotate_move(state, move, solver=default_solver):
+    '''
+    how good move is for whoever's turn it is in state: their odds, the best
+    move, the odds after move (before its outcome is known), and how much
+    less that is than the best
+    '''
+    packed = PackedPhase.from_phase(state.phase)
+    mover = packed.round.turn
+    odds = solver.value(packed, mover)
+    best_move = solver.best_move(packed, packed.player_names[mover])
+    move_odds = sum(chance * solver.value(child, mover) for chance, child in outcomes(packed, move))
+    return {
+        "mover": packed.player_names[mover],
+        "move": describe_move(packed, move),
+        "odds": odds,
+        "best_move": None if best_move is None else describe_move(packed, best_move),
+        "move_odds": move_odds,
+        # moves as good as the best can come out a rounding error worse
+        "value_lost": round(max(0.0, odds - move_odds), 12),
+    }
+
+
+def annotate_logfile(f, solver=default_solver):
+    '''
+    a record (see FIELDS) for every move in a log, in one pass
+
+    every position is solved with the same solver, so its table carries
+    over from one move to the next: after the first move of a round, most of
+    the round has already been solved. odds are the chance of winning the
+    phase before the round runs out of shells, as in odds queries, and
+    queries themselves are skipped. raises what parse_line raises, with the
+    number of the line it failed on as its line attribute.
+    '''
+    state = GameState(player_names=["player", "dealer"])
+    for i, line in enumerate(f):
+        line = line.strip()
+        if line.startswith("#"):
+            continue
+        for part in line.split(";"):
+            words = tokenize(part)
+            if not words or words[0] == "!check":
+                continue
+            try:
+                new_state = parse_line(state, part)
+            except (LogParseError, GameError) as e:
+                e.line = i + 1
+                raise
+            move = played_move(state, words)
+            if move is not None:
+                yield {
+                    "file": f.name,
+                    "line": i + 1,
+                    "phase": state.num_completed_phases + 1,
+                    "round": state.phase.num_completed_rounds + 1,
+                    **annotate_move(state, move, solver),
+                }
+            state = new_state
+
+
+def parse_args():
+    parser = ArgumentParser(description="annotate every move in logs with the mover's odds, the best move, and the odds the move played gave up")
+    parser.add_argument("LOGFILE", nargs="+", type=FileType('r'))
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="JSON lines, or CSV with a header")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    writer = None
+    if args.format == "csv":
+        writer = csv.DictWriter(stdout, FIELDS)
+        writer.writeheader()
+    for logfile in args.LOGFILE:
+        start = perf_counter()
+        slowest = 0.0
+        num_moves = 0
+        try:
+            move_start = perf_counter()
+            for record in annotate_logfile(logfile):
+                slowest = max(slowest, perf_counter() - move_start)
+                num_moves += 1
+                if writer is None:
+                    print(json.dumps(record), flush=True)
+                else:
+                    writer.writerow(record)
+                move_start = perf_counter()
+        except (LogParseError, GameError) as e:
+            exit(f"{logfile.name} failed at line {e.line}: {e}")
+        print(f"{logfile.name}: {num_moves} moves in {perf_counter() - start:.2f}s (slowest {slowest:.2f}s)", file=stderr)
+    print("solver cache:", default_solver.table, file=stderr)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from exceptions import GameError
+
+
+class ShellBeliefs:
+    '''
+    every order the round's shells could have been loaded in that agrees
+    with what we know, all equally likely
+
+    orders are bitmasks with bit i set if shell i is live, so filtering and
+    querying work on the whole array at once. this gives the same chances as
+    counting the remaining shells, for every shell at once. it's built from
+    a round as it stands (see from_round) for each query, rather than kept
+    up to date as the round is played, so parsing never needs numpy.
+    '''
+
+    def __init__(self, total_live_shells, total_blank_shells):
+        self.num_shells = total_live_shells + total_blank_shells
+        self.num_past_shells = 0
+        masks = np.arange(1 << self.num_shells, dtype=np.uint16)
+        self.orders = masks[self._bits(masks).sum(axis=1) == total_live_shells]
+
+    def _bits(self, orders, start=0):
+        '''array of orders x shells from start, 1 where the shell is live'''
+        return (orders[:, None] >> np.arange(start, self.num_shells, dtype=np.uint16)) & 1
+
+    def observe(self, shells):
+        '''keep only the orders where shell i is live if shells[i] (and blank if not) for all i in shells'''
+        checked = 0
+        live = 0
+        for i, is_live in shells.items():
+            checked |= 1 << i
+            live |= is_live << i
+        consistent = (self.orders & checked) == live
+        if not consistent.any():
+            raise GameError("actually, no order of shells is consistent with that")
+        self.orders = self.orders[consistent]
+
+    def live_chances(self):
+        '''chance each remaining shell is live, from the current one on'''
+        bits = self._bits(self.orders, self.num_past_shells)
+        return bits.mean(axis=0)
+
+    @classmethod
+    def from_round(cls, round):
+        '''beliefs about a RoundState's shells, given everything it knows'''
+        beliefs = cls(round.total_live_shells, round.total_blank_shells)
+        beliefs.observe({
+            **dict(enumerate(round.past_shells)),
+            **round.known_shells,
+        })
+        beliefs.num_past_shells = len(round.past_shells)
+        return beliefs
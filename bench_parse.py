@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+from exceptions import GameError
+from game_state import GameState
+from parse_log import LogParseError, parse_line
+
+
+def load_logs(log_dir):
+    '''
+    the lines of every log under log_dir, up to the first line that fails
+
+    odds queries are left out: they time the solver, not the parser
+    '''
+    logs = []
+    for path in sorted(Path(log_dir).rglob("*.buckshot")):
+        lines = []
+        game_state = GameState(player_names=["player", "dealer"])
+        for line in path.read_text().splitlines():
+            if line.startswith("!check") and line.rstrip().endswith("odds"):
+                continue
+            try:
+                game_state = parse_line(game_state, line)
+            except (LogParseError, GameError):
+                break
+            lines.append(line)
+        logs.append(lines)
+    return logs
+
+
+def parse_throughput(logs, repeat=200):
+    '''lines parsed per second, replaying every log repeat times'''
+    num_lines = sum(len(lines) for lines in logs) * repeat
+    start = perf_counter()
+    for _ in range(repeat):
+        for lines in logs:
+            game_state = GameState(player_names=["player", "dealer"])
+            for line in lines:
+                game_state = parse_line(game_state, line)
+    return num_lines / (perf_counter() - start)
+
+
+# modules a run that only parses must never import, since it's meant to start fast
+SOLVER_MODULES = ["solver", "packed_state", "moves", "multiprocessing", "numpy"]
+
+
+def startup_time(command, runs=20):
+    '''median wall time of running command (a list of arguments to python) to completion, in seconds'''
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run([sys.executable, *command], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(perf_counter() - start)
+    return median(times)
+
+
+def imported_modules(command):
+    '''the top-level names of every module python imports running command'''
+    result = subprocess.run([sys.executable, "-X", "importtime", *command], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return {
+        line.rpartition("|")[2].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+def has_odds_queries(log_path):
+    return any(
+        "!check" in line and line.rstrip().endswith("odds")
+        for line in Path(log_path).read_text().splitlines()
+    )
+
+
+def report_startup(log_path, runs=20):
+    '''
+    print how long parse_log.py takes to validate one log, with and without
+    --validate-only, next to python doing nothing, and return False if a
+    run that only parses imported anything from SOLVER_MODULES
+
+    that's --validate-only always, and parse_log.py too if the log has no
+    odds queries
+    '''
+    commands = {
+        "python -c pass": ["-c", "pass"],
+        "parse_log.py --validate-only": ["parse_log.py", "--validate-only", log_path],
+        "parse_log.py": ["parse_log.py", log_path],
+    }
+    for name, command in commands.items():
+        print(f"{name}: {startup_time(command, runs) * 1000:.1f}ms")
+    parse_only = ["parse_log.py --validate-only"]
+    if not has_odds_queries(log_path):
+        parse_only.append("parse_log.py")
+    ok = True
+    for name in parse_only:
+        imported = imported_modules(commands[name])
+        unwanted = [module for module in SOLVER_MODULES if module in imported]
+        if unwanted:
+            print(name, "imported", ", ".join(unwanted))
+            ok = False
+    return ok
+
+
+def parse_args():
+    parser = ArgumentParser(description="measure how fast the bundled logs parse")
+    parser.add_argument("--logs", default="example_logs")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--startup", metavar="LOGFILE", help="instead, time starting parse_log.py to validate LOGFILE (exits non-zero if a run that only parses imports the solver)")
+    parser.add_argument("--runs", type=int, default=20, help="with --startup, how many times to run each command")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.startup is not None:
+        sys.exit(0 if report_startup(args.startup, args.runs) else 1)
+    logs = load_logs(args.logs)
+    print(f"{parse_throughput(logs, args.repeat):.0f} lines/s")
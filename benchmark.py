@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import json
+import platform
+import tracemalloc
+from argparse import ArgumentParser
+from itertools import permutations, product
+from sys import exit, stderr
+from time import perf_counter
+
+from bench_parse import load_logs, parse_throughput
+from items import Items
+from moves import legal_moves, outcomes
+from packed_state import NORMALIZATIONS, PackedPhase, PackedRound, normalize, position_key
+from solver import Solver
+
+SHELL_COUNTS = range(2, 9)
+CHARGE_LEVELS = (1, 2, 4)
+ITEM_LOADOUTS = {
+    "none": (),
+    "story": (Items.MAGNIFYING_GLASS, Items.HAND_SAW),
+    "double_or_nothing": (Items.BURNER_PHONE, Items.INVERTER),
+}
+KNOWN_SHELL_PATTERNS = ("none", "first_live", "last_blank")
+
+# slower than this fraction of the saved run counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# the position check_warm_deepening asks about, and its time budget
+WARM_DEEPENING_POSITION = "8_shells/4_charges/story/none"
+WARM_DEEPENING_BUDGET = 0.5
+
+
+def benchmark_positions():
+    '''the fixed matrix of positions the solver is timed on, by name'''
+    for num_shells, charges, loadout, pattern in product(SHELL_COUNTS, CHARGE_LEVELS, ITEM_LOADOUTS, KNOWN_SHELL_PATTERNS):
+        num_live_shells = (num_shells + 1) // 2
+        round = PackedRound(total_live_shells=num_live_shells, total_blank_shells=num_shells - num_live_shells)
+        match pattern:
+            case "first_live":
+                round = round.learn_future_shell(0, True)
+            case "last_blank":
+                round = round.learn_future_shell(num_shells - 1, False)
+        state = PackedPhase(
+            player_names=("player", "dealer"),
+            charges=(charges, charges),
+            max_charges=charges,
+            items=(ITEM_LOADOUTS[loadout],) * 2,
+            round=round,
+        )
+        yield f"{num_shells}_shells/{charges}_charges/{loadout}/{pattern}", state
+
+
+def time_solver(state):
+    '''solve state with a cold solver, twice: once for time, once for memory'''
+    solver = Solver()
+    start = perf_counter()
+    value = solver.value(state, 0)
+    seconds = perf_counter() - start
+
+    tracemalloc.start()
+    Solver().value(state, 0)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "value": value,
+        "nodes": solver.nodes_searched,
+        "seconds": seconds,
+        "nodes_per_second": solver.nodes_searched / seconds if seconds else None,
+        "peak_bytes": peak_bytes,
+    }
+
+
+def check_warm_deepening(name=WARM_DEEPENING_POSITION, time_budget=WARM_DEEPENING_BUDGET):
+    '''
+    what's wrong (as a list of messages) with a time-budgeted query about a
+    position the solver has already solved: it should get the exact value
+    back from the table, in a small fraction of the budget
+    '''
+    state = dict(benchmark_positions())[name]
+    solver = Solver()
+    value = solver.value(state, 0)
+    start = perf_counter()
+    result = solver.deepening_value(state, 0, time_budget)
+    seconds = perf_counter() - start
+    problems = []
+    if not result.is_exact or result.value != value:
+        problems.append(f"{name}: warm budgeted query gave {result.value} ({result}), not the solved {value}")
+    if seconds > time_budget / 10:
+        problems.append(f"{name}: warm budgeted query took {seconds:.3f}s of its {time_budget}s")
+    return problems
+
+
+def reachable_positions(state):
+    '''
+    every position that can come up before the round ends, starting from
+    state with its items dealt in any order, with every move followed
+    '''
+    roots = [state._replace(items=items) for items in product(*(set(permutations(items)) for items in state.items))]
+    seen = set(roots)
+    stack = roots
+    while stack:
+        state = stack.pop()
+        for move in legal_moves(state, prune=False):
+            for _, child in outcomes(state, move):
+                if child.round is None or sum(charges > 0 for charges in child.charges) <= 1 or child in seen:
+                    continue
+                seen.add(child)
+                stack.append(child)
+    return seen
+
+
+def state_space(state):
+    '''
+    how many different positions can be reached from state, and how many
+    are left as each normalization is added (see packed_state.NORMALIZATIONS),
+    then as the player being solved for (counting each position once per
+    player) once positions that only differ in seating share a key
+    '''
+    positions = reachable_positions(state)
+    counts = {"positions": len(positions)}
+    rules = []
+    for rule in NORMALIZATIONS:
+        rules.append(rule)
+        positions = {normalize(position, rules) for position in positions}
+        counts[rule] = len(positions)
+    num_players = len(state.charges)
+    counts["per player"] = len(positions) * num_players
+    counts["seats"] = len({position_key(position, player) for position in positions for player in range(num_players)})
+    return counts
+
+
+def report_state_space(only=None):
+    '''print how much each normalization shrinks the state space of the benchmark positions'''
+    for name, state in benchmark_positions():
+        if only is not None and only not in name:
+            continue
+        counts = state_space(state)
+        steps = list(counts.items())
+        shrinks = ", ".join(
+            f"{rule} {before / after:.2f}x"
+            for (_, before), (rule, after) in zip(steps, steps[1:])
+            if rule != "per player"
+        )
+        print(f"{name}: {counts["positions"]} positions, {counts["seats"]} keys ({shrinks})")
+
+
+def run_benchmarks(log_dir="example_logs", only=None):
+    results = {
+        "python": platform.python_version(),
+        "solver": {},
+    }
+    for name, state in benchmark_positions():
+        if only is not None and only not in name:
+            continue
+        results["solver"][name] = result = time_solver(state)
+        print(f"{name}: {result["nodes"]} nodes in {result["seconds"]:.4f}s", file=stderr)
+
+    logs = load_logs(log_dir)
+    start = perf_counter()
+    lines_per_second = parse_throughput(logs)
+    results["parser"] = {
+        "lines_per_second": lines_per_second,
+        "seconds": perf_counter() - start,
+    }
+    print(f"parser: {lines_per_second:.0f} lines/s", file=stderr)
+    return results
+
+
+def compare(old, new, tolerance=DEFAULT_TOLERANCE):
+    '''what got slower (or changed its answer) since the old results, as a list of messages'''
+    regressions = []
+    for name, new_result in new["solver"].items():
+        try:
+            old_result = old["solver"][name]
+        except KeyError:
+            continue
+        if new_result["value"] != old_result["value"]:
+            regressions.append(f"{name}: value changed from {old_result["value"]} to {new_result["value"]}")
+        if new_result["seconds"] > old_result["seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: {old_result["seconds"]:.4f}s -> {new_result["seconds"]:.4f}s")
+        if new_result["nodes"] > old_result["nodes"] * (1 + tolerance):
+            regressions.append(f"{name}: {old_result["nodes"]} -> {new_result["nodes"]} nodes")
+    old_rate = old["parser"]["lines_per_second"]
+    new_rate = new["parser"]["lines_per_second"]
+    if new_rate * (1 + tolerance) < old_rate:
+        regressions.append(f"parser: {old_rate:.0f} -> {new_rate:.0f} lines/s")
+    return regressions
+
+
+def parse_args():
+    parser = ArgumentParser(description="time the solver and parser, and compare against an earlier run")
+    parser.add_argument("--save", metavar="PATH", help="write the results to PATH as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="exit non-zero if slower than the results saved in PATH")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="how much slower still passes, as a fraction")
+    parser.add_argument("--only", metavar="SUBSTRING", help="only time solver positions whose names contain SUBSTRING")
+    parser.add_argument("--logs", default="example_logs")
+    parser.add_argument("--state-space", action="store_true", help="instead of timing anything, report how much normalizing positions shrinks the state space")
+    parser.add_argument("--check-warm-deepening", action="store_true", help="instead of timing anything, check that a time-budgeted query about a solved position is answered exactly from the table")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.state_space:
+        report_state_space(args.only)
+        exit()
+    if args.check_warm_deepening:
+        problems = check_warm_deepening()
+        for problem in problems:
+            print("failed:", problem, file=stderr)
+        exit(1 if problems else 0)
+    results = run_benchmarks(args.logs, args.only)
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print("regression:", regression, file=stderr)
+        if regressions:
+            exit(1)
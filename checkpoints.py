@@ -0,0 +1,96 @@
+import pickle
+import sqlite3
+from hashlib import blake2b
+
+# bump whenever GameState changes shape, so old checkpoints are no longer used
+CHECKPOINT_VERSION = 1
+
+# also checkpoint every this many lines, for long rounds
+DEFAULT_INTERVAL = 50
+
+# how many prefixes to look up at once when resuming
+_LOOKUP_BATCH_SIZE = 500
+
+
+def prefix_hashes(lines):
+    '''for each line, a hash of every line up to and including it'''
+    digest = blake2b(f"checkpoints v{CHECKPOINT_VERSION}".encode(), digest_size=16).digest()
+    for line in lines:
+        digest = blake2b(digest + line.encode(), digest_size=16).digest()
+        yield digest
+
+
+class CheckpointStore:
+    '''
+    game states saved partway through logs, in an sqlite database, so that
+    parsing a log again (say, after editing the end of it) starts from the
+    last state it had already reached instead of from the start
+
+    states are keyed by a hash of every line before them, so a checkpoint is
+    used for any log that starts with the same lines, and never for one that
+    doesn't. writes are buffered until flush.
+    '''
+
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                prefix_hash BLOB PRIMARY KEY,
+                num_lines INTEGER NOT NULL,
+                state BLOB NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self.connection.commit()
+        self.pending = {}
+        self.resumed_lines = 0
+
+    def should_checkpoint(self, num_lines, old_state, new_state):
+        '''checkpoint at the start of every round, and every interval lines'''
+        if num_lines % self.interval == 0:
+            return True
+        round_started = new_state.phase is not None and new_state.phase.round is not None
+        return round_started and (old_state.phase is None or old_state.phase.round is None)
+
+    def put(self, prefix_hash, num_lines, state):
+        self.pending[prefix_hash] = (num_lines, pickle.dumps(state))
+
+    def resume(self, hashes):
+        '''
+        (number of lines, state after them) for the longest prefix with a
+        checkpoint, or (0, None) if there's none
+        '''
+        self.flush()
+        for end in range(len(hashes), 0, -_LOOKUP_BATCH_SIZE):
+            batch = hashes[max(0, end - _LOOKUP_BATCH_SIZE):end]
+            row = self.connection.execute(
+                f"SELECT num_lines, state FROM checkpoints WHERE prefix_hash IN ({",".join("?" * len(batch))}) ORDER BY num_lines DESC LIMIT 1",
+                batch,
+            ).fetchone()
+            if row is not None:
+                num_lines, state = row
+                self.resumed_lines += num_lines
+                return num_lines, pickle.loads(state)
+        return 0, None
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO checkpoints (prefix_hash, num_lines, state) VALUES (?, ?, ?)",
+            ((prefix_hash, num_lines, state) for prefix_hash, (num_lines, state) in self.pending.items()),
+        )
+        self.connection.commit()
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+    def __str__(self):
+        return f"{self.resumed_lines} lines skipped, {len(self)} checkpoints in {self.path}"
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+
+import os
+from argparse import ArgumentParser, FileType
+from concurrent.futures import ProcessPoolExecutor
+from random import Random, randrange
+from sys import exit, stderr
+from time import perf_counter
+from typing import NamedTuple
+
+from annotate import played_move
+from exceptions import GameError, TurnError
+from game_state import GameState
+from items import Items
+from moves import outcomes
+from packed_state import PackedPhase
+from parse_log import LogParseError, cardinal_to_ordinal, items_by_name, parse_line, tokenize
+from replay import CARDINALS, ITEM_NAMES, apply_event, line_events
+
+# everyone at the table, for games with more than two players
+PLAYER_NAMES = ("player", "dealer", "gambler")
+
+# chance of each kind of mistake the generator makes on purpose
+WRONG_TURN_CHANCE = 0.05
+MISSING_ITEM_CHANCE = 0.1
+RANDOM_SHELL_CHANCE = 0.2
+BAD_LOAD_CHANCE = 0.05
+WRONG_WINNER_CHANCE = 0.1
+
+# chance a game is played in double-or-nothing mode
+DOUBLE_OR_NOTHING_CHANCE = 0.3
+
+# lines per case, not counting the setup of the first round
+DEFAULT_MAX_LINES = 60
+
+
+class Divergence(NamedTuple):
+    line: int     # index into the case's lines
+    engine: str
+    message: str
+
+
+def run_case(lines):
+    '''
+    run lines through the reference rules (parse_line on a GameState) and
+    every other engine, returning the first Divergence, or None if they all
+    agree
+
+    lines the reference rejects leave the state as it was, as with
+    parse_log.py --follow. the other engines are:
+
+    - packed: PackedPhase.shoot and use_item, which the solver plays on. it
+      has to reject the same moves (apart from turn order and targets who
+      are already out, which legal_moves checks instead) and end up in the
+      same state.
+    - outcomes: moves.outcomes, which the solver expands. what the line says
+      happened has to be one of its outcomes, with a chance above zero.
+    - replay: replay.apply_event, on the events of every line the reference
+      accepts (two players only).
+    - game: who the reference says has won the game when a phase ends, which
+      has to follow from who's won each phase (see _game_winner).
+    '''
+    reference = GameState(player_names=["player", "dealer"])
+    replayed = reference.copy()
+    for i, line in enumerate(lines):
+        words = tokenize(line)
+        before = reference
+        try:
+            reference = parse_line(reference, line)
+            error = None
+        except LogParseError:
+            continue
+        except GameError as e:
+            error = e
+        except Exception as e:
+            return Divergence(i, "reference", f"crashed: {type(e).__name__}: {e}")
+
+        if words[0] == "players":
+            replayed = None
+        is_move = before.phase is not None and before.phase.round is not None and words[1] in ("shoots", "uses")
+        if is_move and words[0] != before.phase.current_player_name():
+            if not isinstance(error, TurnError):
+                return Divergence(i, "reference", f"{words[0]} moved out of turn ({error or "accepted"})")
+            continue
+        if is_move:
+            divergence = _check_packed(before, reference, words, error)
+            if divergence is not None:
+                return Divergence(i, *divergence)
+        if reference.num_completed_phases > before.num_completed_phases and reference.winner != _game_winner(reference):
+            return Divergence(i, "game", f"game won by {reference.winner}, not {_game_winner(reference)}")
+        if error is None and replayed is not None:
+            for event in line_events(words, i + 1):
+                apply_event(replayed, event)
+            if replayed != reference:
+                return Divergence(i, "replay", f"replayed state {replayed} != {reference}")
+    return None
+
+
+def _check_packed(before, reference, words, error):
+    '''(engine, message) if the packed engine or outcomes disagree with the reference about a move, else None'''
+    state = PackedPhase.from_phase(before.phase)
+    try:
+        packed = _packed_move(state, words)
+    except GameError as e:
+        if error is None:
+            return "packed", f"rejected a move the reference accepts: {e}"
+        return None
+    if packed is None:
+        return None
+    if error is not None:
+        return "packed", f"accepted a move the reference rejects: {error}"
+    expected = _result(reference)
+    if _packed_result(packed) != expected:
+        return "packed", _difference(_packed_result(packed), expected)
+
+    # a phone or glass nobody says the result of isn't any particular outcome
+    if words[2:3] in (["phone"], ["glass"]) and len(words) == 3:
+        return None
+    results = outcomes(state, played_move(before, words))
+    if abs(sum(chance for chance, _ in results) - 1.0) > 1e-9:
+        return "outcomes", f"chances add up to {sum(chance for chance, _ in results)}"
+    if packed not in [child for _, child in results]:
+        return "outcomes", "none of the outcomes match: " + "; ".join(f"{chance:.3f}: {_difference(child, packed)}" for chance, child in results)
+    return None
+
+
+def _game_winner(game):
+    '''who's won game, going by who's won each phase so far, or None if nobody has yet'''
+    winner_name = game.winner_names_by_phase[-1]
+    # in double-or-nothing, the player has to win every phase
+    if game.is_double_or_nothing_mode and "player" in game.player_names and winner_name != "player":
+        return winner_name
+    if game.num_completed_phases == game.total_phases:
+        return winner_name
+    return None
+
+
+def _packed_move(state, words):
+    '''
+    the PackedPhase after a move line, or None if it's a move packed states
+    don't check (shooting someone who's already out)
+    '''
+    player_names = state.player_names
+    user = state.round.turn
+    match words:
+        case [_, "shoots", target_name, ",", shell_type]:
+            target = user if target_name == "self" else _seat(player_names, target_name)
+            if state.is_out(target):
+                return None
+            return state.shoot(target, shell_type == "live")
+        case [_, "uses", "jammer", "on", target_name]:
+            return state.use_item(user, Items.JAMMER, on=_seat(player_names, target_name))
+        case [_, "uses", "phone", ",", "hears", cardinal, shell_type]:
+            return state.use_item(user, Items.BURNER_PHONE, (cardinal_to_ordinal[cardinal], shell_type == "live"))
+        case [_, "uses", item_name, ",", _, shell_type]:
+            return state.use_item(user, items_by_name[item_name], shell_type == "live")
+        case [_, "uses", item_name]:
+            return state.use_item(user, items_by_name[item_name])
+    raise ValueError(f"not a move: {" ".join(words)}")
+
+
+def _seat(player_names, name):
+    if name not in player_names:
+        raise GameError(f"no such player {name}")
+    return player_names.index(name)
+
+
+def _difference(got, expected):
+    '''the fields two phases (or results) differ in'''
+    if not isinstance(got, PackedPhase) or not isinstance(expected, PackedPhase):
+        return f"{got} != {expected}"
+    differences = [
+        f"{field} {getattr(got, field)} != {getattr(expected, field)}"
+        for field in got._fields
+        if field != "round" and getattr(got, field) != getattr(expected, field)
+    ]
+    if got.round is None or expected.round is None:
+        if got.round != expected.round:
+            differences.append(f"round {got.round} != {expected.round}")
+    else:
+        differences.extend(
+            f"round.{field} {getattr(got.round, field)} != {getattr(expected.round, field)}"
+            for field in got.round._fields
+            if getattr(got.round, field) != getattr(expected.round, field)
+        )
+    return ", ".join(differences) or "same"
+
+
+def _result(game):
+    '''how a phase stands, so a GameState and a PackedPhase can be compared'''
+    if game.phase is None:
+        return ("won by", game.winner_names_by_phase[-1])
+    return PackedPhase.from_phase(game.phase)
+
+def _packed_result(state):
+    survivors = [name for name, charges in zip(state.player_names, state.charges) if charges > 0]
+    if len(survivors) <= 1:
+        return ("won by", survivors[0])
+    return state
+
+
+def random_case(rng, max_lines=DEFAULT_MAX_LINES):
+    '''
+    the lines of a random game, up to max_lines moves of it, mostly legal:
+    now and then a move is out of turn, uses an item the player doesn't
+    have, or says a shell is something it can't be, a round is loaded wrong,
+    and someone's said to have won a phase they didn't
+    '''
+    num_players = 3 if rng.random() < 0.2 else 2
+    player_names = PLAYER_NAMES[:num_players]
+    lines = []
+    if num_players > 2:
+        lines.append(f"players {", ".join(player_names)}")
+    if rng.random() < DOUBLE_OR_NOTHING_CHANCE:
+        lines.append("player uses pills")
+
+    state = GameState(player_names=["player", "dealer"])
+    for line in lines:
+        state = parse_line(state, line)
+
+    # each line is generated from the state after the ones before it
+    num_moves = 0
+    while state.winner is None and num_moves < max_lines:
+        if state.phase is None:
+            new_lines = [_phase_setup(rng, state)]
+        elif state.phase.round is None:
+            new_lines = _round_setup(rng, state)
+        else:
+            new_lines = [_random_move(rng, state)]
+            num_moves += 1
+        for line in new_lines:
+            lines.append(line)
+            num_completed_phases = state.num_completed_phases
+            try:
+                state = parse_line(state, line)
+            except (LogParseError, GameError):
+                pass
+            if state.num_completed_phases > num_completed_phases:
+                lines.append(f"{_claimed_winner(rng, state, state.winner_names_by_phase[-1])} wins phase {"I" * state.num_completed_phases}")
+    if state.winner is not None:
+        lines.append(f"{_claimed_winner(rng, state, state.winner)} wins game")
+    return lines
+
+
+def _claimed_winner(rng, state, winner_name):
+    return rng.choice(state.player_names) if rng.random() < WRONG_WINNER_CHANCE else winner_name
+
+
+def _phase_setup(rng, state):
+    max_charges = rng.randint(1, 6)
+    critical_charges = rng.choice([0, 0, 1, 2]) if max_charges > 2 else 0
+    line = f"phase {"I" * (state.num_completed_phases + 1)}, {max_charges} charges"
+    return line + (f", critical at {critical_charges}" if critical_charges else "")
+
+
+def _round_setup(rng, state):
+    lines = [f"round {"I" * (state.num_completed_phases + 1)}.{state.phase.num_completed_rounds + 1}"]
+    item_names = sorted(items_by_name)
+    for name in state.player_names:
+        items = rng.choices(item_names, k=rng.randint(0, 3))
+        if items:
+            lines.append(f"{name} gets {", ".join(items)}")
+    num_shells = rng.randint(2, 8)
+    live = rng.randint(1, num_shells - 1)
+    if rng.random() < BAD_LOAD_CHANCE:
+        live = rng.choice([0, num_shells, live + 8])
+    lines.append(f"dealer loads {live} live, {num_shells - live} blank")
+    return lines
+
+
+def _random_move(rng, state):
+    phase = state.phase
+    round = phase.round
+    names = list(phase.players)
+    mover = phase.current_player_name()
+    if rng.random() < WRONG_TURN_CHANCE:
+        mover = rng.choice(names)
+    items = phase.players[mover].items
+    if items and rng.random() < 0.5:
+        item = rng.choice(items)
+    elif rng.random() < MISSING_ITEM_CHANCE:
+        item = rng.choice(list(ITEM_NAMES))
+    else:
+        item = None
+
+    def shell():
+        if rng.random() < RANDOM_SHELL_CHANCE:
+            return rng.choice(["live", "blank"])
+        return "live" if rng.random() < round.chance_shell_is_live() else "blank"
+
+    if item is None:
+        targets = [name for name in names if phase.players[name].charges > 0]
+        target = rng.choice(targets)
+        return f"{mover} shoots {"self" if target == mover else target}, {shell()}"
+    item_name = ITEM_NAMES[item]
+    match item:
+        case Items.MAGNIFYING_GLASS if mover == "player":
+            return f"player uses glass, sees {shell()}"
+        case Items.BURNER_PHONE if mover == "player":
+            shells_from_now = rng.randint(1, max(1, round.total_shells() - len(round.past_shells)))
+            return f"player uses phone, hears {CARDINALS.get(shells_from_now, "eighth")} {rng.choice(["live", "blank"])}"
+        case Items.BEER:
+            return f"{mover} uses beer, ejects {shell()}"
+        case Items.JAMMER:
+            return f"{mover} uses jammer on {rng.choice([name for name in names if name != mover])}"
+    return f"{mover} uses {item_name}"
+
+
+def shrink(lines, divergence):
+    '''
+    the shortest log found by dropping lines (in halves, then quarters, down
+    to one at a time) that still makes the same engine diverge
+    '''
+    chunk_size = max(1, len(lines) // 2)
+    while True:
+        i = 0
+        shrunk = False
+        while i < len(lines):
+            candidate = lines[:i] + lines[i + chunk_size:]
+            candidate_divergence = run_case(candidate)
+            if candidate_divergence is not None and candidate_divergence.engine == divergence.engine:
+                lines, divergence = candidate, candidate_divergence
+                shrunk = True
+            else:
+                i += chunk_size
+        if chunk_size == 1 and not shrunk:
+            return lines, divergence
+        if not shrunk:
+            chunk_size = max(1, chunk_size // 2)
+
+
+class FuzzResult(NamedTuple):
+    cases: int
+    lines: int
+    seconds: float
+    failures: list  # (seed, shrunk lines, Divergence)
+
+
+def fuzz(first_seed, num_cases, max_lines=DEFAULT_MAX_LINES):
+    '''run cases seeded first_seed, first_seed + 1, ..., shrinking any that diverge'''
+    start = perf_counter()
+    num_lines = 0
+    failures = []
+    for seed in range(first_seed, first_seed + num_cases):
+        lines = random_case(Random(seed), max_lines)
+        num_lines += len(lines)
+        divergence = run_case(lines)
+        if divergence is not None:
+            failures.append((seed, *shrink(lines, divergence)))
+    return FuzzResult(num_cases, num_lines, perf_counter() - start, failures)
+
+
+def log_lines(f):
+    '''
+    the lines of a log as run_case takes them: conjoined lines split up, and
+    without comments or odds queries (which would be solved)
+    '''
+    lines = []
+    for line in f:
+        line = line.strip()
+        if line.startswith("#"):
+            continue
+        for part in line.split(";"):
+            words = part.split()
+            if words and not (words[0] == "!check" and words[-1] == "odds"):
+                lines.append(part.strip())
+    return lines
+
+
+def write_failure(outdir, seed, lines, divergence):
+    '''write a shrunk case as a .buckshot log that parse_log.py can run, returning its path'''
+    # three lines of header, then the case
+    header = [
+        f"# fuzz.py --seed {seed} --cases 1",
+        f"# {divergence.engine} diverges from the reference at line {divergence.line + 4}:",
+        f"# {divergence.message}",
+    ]
+    path = os.path.join(outdir, f"fuzz_{seed}_{divergence.engine}.buckshot")
+    with open(path, "w") as f:
+        f.write("\n".join(header + lines) + "\n")
+    return path
+
+
+def parse_args():
+    parser = ArgumentParser(description="play random (and sometimes illegal) games through every engine, and report where they disagree with the reference rules")
+    parser.add_argument("LOGFILE", nargs="*", type=FileType('r'), help="instead of generating cases, run these logs through every engine")
+    parser.add_argument("--cases", type=int, default=1000)
+    parser.add_argument("--seed", type=int, help="case i is generated with seed + i, so any one can be run again with --cases 1")
+    parser.add_argument("--max-lines", type=int, default=DEFAULT_MAX_LINES, help="moves per case")
+    parser.add_argument("--workers", type=int, default=1, help="processes to run cases in")
+    parser.add_argument("--out", default="fuzz_failures", help="directory to write shrunk failing cases to")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.LOGFILE:
+        num_divergences = 0
+        for logfile in args.LOGFILE:
+            lines = log_lines(logfile)
+            divergence = run_case(lines)
+            if divergence is not None:
+                num_divergences += 1
+                print(f"{logfile.name}: {divergence.engine} diverged at {lines[divergence.line]!r}: {divergence.message}", file=stderr)
+        print(f"{len(args.LOGFILE)} logs, {num_divergences} divergences", file=stderr)
+        exit(1 if num_divergences else 0)
+
+    seed = randrange(2 ** 32) if args.seed is None else args.seed
+    start = perf_counter()
+    if args.workers > 1:
+        chunk_size = -(-args.cases // args.workers)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(fuzz, seed + first_case, min(chunk_size, args.cases - first_case), args.max_lines)
+                for first_case in range(0, args.cases, chunk_size)
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [fuzz(seed, args.cases, args.max_lines)]
+    seconds = perf_counter() - start
+
+    failures = [failure for result in results for failure in result.failures]
+    if failures:
+        os.makedirs(args.out, exist_ok=True)
+    for failure in failures:
+        path = write_failure(args.out, *failure)
+        print(f"{failure[2].engine} diverged: {path} ({len(failure[1])} lines)", file=stderr)
+    num_cases = sum(result.cases for result in results)
+    num_lines = sum(result.lines for result in results)
+    print(f"{num_cases} cases ({num_lines} lines) in {seconds:.2f}s: {num_cases / seconds:.0f} execs/s, {num_lines / seconds:.0f} lines/s, seed {seed}, {len(failures)} divergences", file=stderr)
+    if failures:
+        exit(1)
@@ -1,7 +1,5 @@
 from collections import OrderedDict
-from copy import deepcopy
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Set
+from dataclasses import dataclass, field, replace
 
 from exceptions import GameError
 from items import Items
@@ -13,11 +11,24 @@ type ShellType = bool
 class RoundState:
     total_live_shells: int
     total_blank_shells: int
-    past_shells: List[ShellType] = field(default_factory=list)
-    is_players_turn: bool = True
+    past_shells: list[ShellType] = field(default_factory=list)
+    turn: int = 0 # index of the player whose turn it is, in the order of PhaseState.players
     gun_is_sawed: bool = False
-    handcuffed_player_names: Set[str] = field(default_factory=set)
-    known_shells: Dict[int, ShellType] = field(default_factory=dict)
+    handcuffed_player_names: set[str] = field(default_factory=set)
+    known_shells: dict[int, ShellType] = field(default_factory=dict)
+    is_reversed: bool = False # turns go backwards through the players (remote)
+
+    @property
+    def is_players_turn(self) -> bool:
+        return self.turn == 0
+
+    def copy(self) -> "RoundState":
+        return replace(
+            self,
+            past_shells=list(self.past_shells),
+            handcuffed_player_names=set(self.handcuffed_player_names),
+            known_shells=dict(self.known_shells),
+        )
 
     def remaining_live_shells(self) -> int:
         return self.total_live_shells - sum(1 for is_live in self.past_shells if is_live)
@@ -46,9 +57,11 @@ class RoundState:
                 raise GameError(f"actually, player knows this shell to be {"live" if known_shell_is_live else "blank"}")
 
         # does it contradict with something we can deduce based on shell count
+        # (not counting other shells still to come that we know)
         except KeyError:
+            known_later_shells = sum(1 for j, known_is_live in self.known_shells.items() if j >= len(self.past_shells) and known_is_live == is_live)
             remaining_matching_shells = self.remaining_live_shells() if is_live else self.remaining_blank_shells()
-            if remaining_matching_shells < 1:
+            if remaining_matching_shells - known_later_shells < 1:
                 raise GameError(f"actually, there are no {"live" if is_live else "blank"} shells left")
 
     def chance_shell_is_live(self):
@@ -62,9 +75,12 @@ class RoundState:
         try:
             return 1.0 if self.known_shells[i] else 0.0
 
-        # does it contradict with something we can deduce based on shell count
+        # otherwise it's drawn from the shells we know nothing about
         except KeyError:
-            return self.remaining_live_shells() / self.total_shells()
+            known_future_shells = [is_live for j, is_live in self.known_shells.items() if j > i]
+            unknown_live_shells = self.remaining_live_shells() - sum(known_future_shells)
+            unknown_shells = self.total_shells() - i - len(known_future_shells)
+            return unknown_live_shells / unknown_shells
 
 
     def _eject_shell(self, is_live):
@@ -74,17 +90,27 @@ class RoundState:
 @dataclass
 class Player:
     charges: int
-    items: List[Items] = field(default_factory=list)
+    items: list[Items] = field(default_factory=list)
     is_critical: bool = False
 
+    def copy(self) -> "Player":
+        return replace(self, items=list(self.items))
+
 @dataclass
 class PhaseState:
     players: OrderedDict[str, Player]
     max_charges: int
     critical_charges: int = 0
-    round: Optional[RoundState] = None
+    round: RoundState | None = None
     num_completed_rounds: int = 0
 
+    def copy(self) -> "PhaseState":
+        return replace(
+            self,
+            players=OrderedDict((name, player.copy()) for name, player in self.players.items()),
+            round=None if self.round is None else self.round.copy(),
+        )
+
     def eject_shell(self, is_live):
         self.round._eject_shell(is_live)
 
@@ -93,55 +119,50 @@ class PhaseState:
             self.round = None
             self.num_completed_rounds += 1
 
-    def win_probability(self, player_name, depth=1):
-        if self.round is None:
-            print(" " * depth, "no winner") # DEBUG
-            return 0.0
-        opponent_name = "dealer" if player_name == "player" else "player"
-        if self.players[player_name].charges <= 0:
-            print(" " * depth, opponent_name, "wins") # DEBUG
-            return 0.0
-        if self.players[opponent_name].charges <= 0:
-            print (" " * depth, player_name, "wins") # DEBUG
-            return 1.0
-        live_chance = self.round.chance_shell_is_live()
-        blank_chance = 1.0 - live_chance
-
-        # FIXME not correctly simulating opponent turns by reversing polarity!!!
-        try:
-            shoot_dealer_live_win_chance = 0.0
-            if live_chance > 0.0:
-                shoot_dealer_live = deepcopy(self)
-                shoot_dealer_live._shoot("dealer", True)
-                shoot_dealer_live_win_chance = shoot_dealer_live.win_probability(player_name, depth=depth+1) * live_chance
-
-            shoot_dealer_blank_win_chance = 0.0
-            if blank_chance > 0.0:
-                shoot_dealer_blank = deepcopy(self)
-                shoot_dealer_blank._shoot("dealer", False)
-                shoot_dealer_blank_win_chance = shoot_dealer_blank.win_probability(player_name, depth=depth+1) * blank_chance
-
-            shoot_player_live_win_chance = 0.0
-            if live_chance > 0.0:
-                shoot_player_live = deepcopy(self)
-                shoot_player_live._shoot("player", True)
-                shoot_player_live_win_chance = shoot_player_live.win_probability(player_name, depth=depth+1) * live_chance
-
-            shoot_player_blank_win_chance = 0.0
-            if blank_chance > 0.0:
-                shoot_player_blank = deepcopy(self)
-                shoot_player_blank._shoot("player", False)
-                shoot_player_blank_win_chance = shoot_player_blank.win_probability(player_name, depth=depth+1) * blank_chance
-        except GameError:
-            return 0.0
-
-        shoot_dealer_win_chance = shoot_dealer_live_win_chance + shoot_dealer_blank_win_chance
-        shoot_player_win_chance = shoot_player_live_win_chance + shoot_player_blank_win_chance
-        if shoot_player_win_chance > shoot_dealer_win_chance:
-            print(" " * depth, "player" if self.round.is_players_turn else "dealer", "shoots player")
-        else:
-            print(" " * depth, "player" if self.round.is_players_turn else "dealer", "shoots dealer")
-        return max(shoot_dealer_win_chance, shoot_player_win_chance)
+    def next_player(self, i):
+        '''index of the player who plays after the i-th one, skipping anyone who's out'''
+        names = list(self.players)
+        step = -1 if self.round is not None and self.round.is_reversed else 1
+        for _ in range(len(names)):
+            i = (i + step) % len(names)
+            if self.players[names[i]].charges > 0:
+                return i
+        return i
+
+    def current_player_name(self) -> str:
+        return list(self.players)[self.round.turn]
+
+    def use_item(self, user_name, item, is_live=None, shells_from_now=0, target_name=None):
+        '''
+        what happens when user_name uses item, once it's out of their hands
+
+        is_live is the shell the item showed or ejected, if we know it.
+        target_name is who the jammer is used on.
+        '''
+        match item:
+            case Items.CIGARETTES:
+                user = self.players[user_name]
+                if not user.is_critical:
+                    user.charges = min(self.max_charges, user.charges + 1)
+            case Items.HAND_SAW:
+                self.round.gun_is_sawed = True
+            case Items.HANDCUFFS:
+                other_player = list(self.players)[self.next_player(list(self.players).index(user_name))]
+                self.round.handcuffed_player_names.add(other_player)
+            case Items.JAMMER:
+                self.round.handcuffed_player_names.add(target_name)
+            case Items.REMOTE:
+                self.round.is_reversed = not self.round.is_reversed
+            case Items.MAGNIFYING_GLASS | Items.BURNER_PHONE:
+                if is_live is not None:
+                    self.round.learn_future_shell(shells_from_now, is_live)
+            case Items.BEER:
+                self.eject_shell(is_live)
+
+    def win_probability(self, player_name, depth=1, solver=None):
+        if solver is None:
+            from solver import default_solver as solver
+        return solver.win_probability(self, player_name, depth=depth)
 
     def _shoot(self, target_name, is_live):
 
@@ -167,43 +188,54 @@ class PhaseState:
         if not self.round:
             return
 
-        # advance turn
-        shooter_name = "player" if self.round.is_players_turn else "dealer"
-        if shooter_name != target_name or is_live:
-            next_player = "dealer" if self.round.is_players_turn else "player"
-            try:
-                self.round.handcuffed_player_names.remove(next_player)
-            except KeyError:
-                self.round.is_players_turn = not self.round.is_players_turn
+        # advance turn, skipping (and uncuffing) anyone who's handcuffed
+        if self.current_player_name() != target_name or is_live:
+            names = list(self.players)
+            next_player = self.next_player(self.round.turn)
+            while names[next_player] in self.round.handcuffed_player_names:
+                self.round.handcuffed_player_names.remove(names[next_player])
+                next_player = self.next_player(next_player)
+            self.round.turn = next_player
 
 @dataclass
 class GameState:
-    player_names: List[str]
+    player_names: list[str]
     is_double_or_nothing_mode: bool = False
     total_phases: int = 3
-    phase: Optional[PhaseState] = None
+    phase: PhaseState | None = None
     num_completed_phases: int = 0
-    winner_names_by_phase: List[str] = field(default_factory=list) # just for sanity checking logs
-    winner: Optional[str] = None
+    winner_names_by_phase: list[str] = field(default_factory=list) # just for sanity checking logs
+    winner: str | None = None
     max_items: int = 8
 
+    def copy(self) -> "GameState":
+        '''copy just deep enough that changing the copy never changes the original'''
+        return replace(
+            self,
+            player_names=list(self.player_names),
+            phase=None if self.phase is None else self.phase.copy(),
+            winner_names_by_phase=list(self.winner_names_by_phase),
+        )
+
     def shoot(self, target_name, is_live):
         self.phase._shoot(target_name, is_live)
-        non_target_name = "dealer" if target_name == "player" else "player"
-        if self.phase.players[target_name].charges <= 0:
+        survivor_names = [name for name, player in self.phase.players.items() if player.charges > 0]
+        if self.phase.players[target_name].charges <= 0 and len(survivor_names) == 1:
 
-            # the non-target wins the phase
-            self.winner_names_by_phase.append(non_target_name)
+            # the last one standing wins the phase
+            winner_name = survivor_names[0]
+            self.winner_names_by_phase.append(winner_name)
             self.num_completed_phases += 1
             self.phase = None
 
-            # the non-target wins the game if:
+            # they win the game if:
             if (
-                # the human player dies in double-or-nothing mode
-                (target_name == "player" and self.is_double_or_nothing_mode)
+                # the human player loses a phase in double-or-nothing mode
+                # (with more players, they might not be the last to die)
+                (self.is_double_or_nothing_mode and "player" in self.player_names and winner_name != "player")
 
                 # or the target dies in the last phase
                 or (self.num_completed_phases == self.total_phases)
             ):
-                self.winner = non_target_name
+                self.winner = winner_name
             return
@@ -0,0 +1,217 @@
+from collections import Counter
+from functools import partial
+from itertools import combinations_with_replacement, product
+from math import comb, factorial, prod
+from random import Random
+from typing import NamedTuple, Optional
+
+from exceptions import GameError
+from packed_state import PackedPhase, PackedRound
+from simulate import ITEM_POOLS, PHASES
+from solver import Solver, TranspositionTable, heuristic_value
+
+# rounds solved after the one in progress; the ones after those get
+# heuristic_value. each one multiplies the rounds to solve by up to
+# DEFAULT_SAMPLES times however many ways the round before can end
+DEFAULT_ROUNDS_AHEAD = 1
+
+# whether the rounds ahead are solved with new items dealt, which is more
+# accurate but takes up to a minute a round (most of it for the rounds
+# where everyone holds most of their items); without, they only get a new
+# load of shells, which is a fraction of a second
+DEFAULT_DEAL_ITEMS = False
+
+# when the next round could start in more ways than this, this many of them
+# are drawn at random and solved instead
+DEFAULT_SAMPLES = 32
+
+# as in GameState
+MAX_ITEMS = 8
+
+
+def shell_loads():
+    '''(chance, live, blank) for every way a round can be loaded, as simulate.py loads them: 2-8 shells, at least one of each'''
+    for num_shells in range(2, 9):
+        for live in range(1, num_shells):
+            yield 1 / 7 / (num_shells - 1), live, num_shells - live
+
+
+def item_deals(item_pool, num_items):
+    '''(chance, items) for every set of num_items items that can be dealt, each drawn from item_pool'''
+    for items in combinations_with_replacement(item_pool, num_items):
+        orders = factorial(num_items) // prod(factorial(count) for count in Counter(items).values())
+        yield orders / len(item_pool) ** num_items, items
+
+
+def next_rounds(state, item_pool, num_items, samples=DEFAULT_SAMPLES, seed=0):
+    '''
+    (chance, state) for each way the round after state (a phase between
+    rounds) can start: shells loaded, and up to num_items items dealt to
+    everyone still in
+
+    if there are more than samples of them, samples of them are drawn at
+    random (seeded with seed), each with chance 1 / samples
+    '''
+    items = state.items or ((),) * len(state.charges)
+    deal_sizes = [
+        min(num_items, MAX_ITEMS - len(player_items)) if charges > 0 else 0
+        for charges, player_items in zip(state.charges, items)
+    ]
+    loads = list(shell_loads())
+    num_deals = prod(comb(len(item_pool) + size - 1, size) for size in deal_sizes)
+    if len(loads) * num_deals <= samples:
+        deals = [list(item_deals(item_pool, size)) for size in deal_sizes]
+        for (load_chance, live, blank), dealt in product(loads, product(*deals)):
+            chance = load_chance * prod(deal_chance for deal_chance, _ in dealt)
+            yield chance, _start_round(state, live, blank, [new_items for _, new_items in dealt])
+        return
+
+    rng = Random(seed)
+    load_chances = [chance for chance, _, _ in loads]
+    for _ in range(samples):
+        _, live, blank = rng.choices(loads, weights=load_chances)[0]
+        dealt = [rng.choices(item_pool, k=size) for size in deal_sizes]
+        yield 1 / samples, _start_round(state, live, blank, dealt)
+
+
+def _start_round(state, live, blank, dealt):
+    items = state.items or ((),) * len(state.charges)
+    return state._replace(
+        items=tuple(tuple(sorted(player_items + tuple(new_items))) for player_items, new_items in zip(items, dealt)),
+        # the first player who's still in goes first
+        round=PackedRound(total_live_shells=live, total_blank_shells=blank, turn=next(i for i, charges in enumerate(state.charges) if charges > 0)),
+    )
+
+
+def fresh_phase(player_names, mode, phase_num):
+    '''a phase of a game in mode (story or double_or_nothing) before its first round'''
+    max_charges, critical_charges, _ = PHASES[mode][phase_num]
+    return PackedPhase(
+        player_names=tuple(player_names),
+        charges=(max_charges,) * len(player_names),
+        max_charges=max_charges,
+        critical_charges=critical_charges,
+        items=((),) * len(player_names),
+    )
+
+
+class GameOdds(NamedTuple):
+    phase: Optional[float]  # None once the game is over
+    game: float
+
+    def __str__(self):
+        if self.phase is None:
+            return f"game {self.game:.3f}"
+        return f"phase {self.phase:.3f}, game {self.game:.3f}"
+
+
+class GameEvaluator:
+    '''
+    chances of winning the phase and the game, not just the round in progress
+
+    when a round runs out of shells, the next one starts with a new load, as
+    simulate.py loads them (see next_rounds), and with deal_items, new items
+    dealt the same way (without, everyone just keeps the items they have).
+    the value of a position between rounds is the average of the values of
+    the rounds that can follow it, which are solved with the same rule at
+    their ends, for rounds_ahead rounds after the one in progress; past
+    those, positions between rounds get heuristic_value. each depth has its
+    own Solver, so rounds are solved once per depth and reused by every
+    query after that, and values between rounds are cached too.
+
+    winning the phase is worth the chance of winning the game after it: in
+    story mode, only the last phase decides the game; in double-or-nothing,
+    the player has to win every phase. later phases are valued from their
+    start, the same way.
+    '''
+
+    def __init__(self, rounds_ahead=DEFAULT_ROUNDS_AHEAD, samples=DEFAULT_SAMPLES, max_size=1_000_000, deal_items=DEFAULT_DEAL_ITEMS):
+        self.rounds_ahead = rounds_ahead
+        self.samples = samples
+        self.deal_items = deal_items
+        self.max_size = max_size
+        self.solvers = {}
+        self.between_rounds = {}
+        self.rounds_solved = 0
+
+    def __str__(self):
+        return f"{self.rounds_solved} rounds solved, {len(self.between_rounds)} positions between rounds"
+
+    def solver(self, mode, phase_num, rounds_ahead):
+        '''the solver for rounds in phase_num with rounds_ahead more rounds solved after them'''
+        key = (mode, phase_num, rounds_ahead)
+        if key not in self.solvers:
+            round_end = partial(self.between_rounds_value, mode, phase_num, rounds_ahead)
+            self.solvers[key] = Solver(table=TranspositionTable(max_size=self.max_size), round_end=round_end)
+        return self.solvers[key]
+
+    def between_rounds_value(self, mode, phase_num, rounds_ahead, state, player):
+        '''chance that player wins the phase from state, a position between rounds, solving rounds_ahead more rounds'''
+        if rounds_ahead == 0:
+            return heuristic_value(state, player)
+        items = state.items or ((),) * len(state.charges)
+        key = (
+            mode,
+            phase_num,
+            rounds_ahead,
+            player,
+            state.max_charges,
+            state.critical_charges,
+            state.charges,
+            state.critical,
+            tuple(tuple(sorted(player_items)) for player_items in items),
+        )
+        value = self.between_rounds.get(key)
+        if value is None:
+            solver = self.solver(mode, phase_num, rounds_ahead - 1)
+            _, _, num_items = PHASES[mode][phase_num]
+            if not self.deal_items:
+                num_items = 0
+            value = 0.0
+            for chance, setup in next_rounds(state, ITEM_POOLS[mode], num_items, self.samples, seed=repr(key)):
+                value += chance * solver.value(setup, player)
+                self.rounds_solved += 1
+            self.between_rounds[key] = value
+        return value
+
+    def phase_value(self, phase, player_name, mode="story", phase_num=0):
+        '''
+        chance that player_name wins the phase, whether a round is in progress
+        or not (if not, there's no round in progress to solve, so only
+        rounds_ahead rounds are)
+        '''
+        if phase_num >= len(PHASES[mode]):
+            raise GameError(f"no phase {phase_num + 1} in {mode} mode")
+        state = phase if isinstance(phase, PackedPhase) else PackedPhase.from_phase(phase)
+        player = state.player_names.index(player_name)
+        return self.solver(mode, phase_num, self.rounds_ahead).value(state, player)
+
+    def win_probabilities(self, game, player_name):
+        '''GameOdds for player_name in game (a GameState)'''
+        if game.winner is not None:
+            return GameOdds(None, 1.0 if game.winner == player_name else 0.0)
+        if len(game.player_names) != 2:
+            raise GameError("game odds are only worked out for two players")
+        mode = "double_or_nothing" if game.is_double_or_nothing_mode else "story"
+        phase_num = game.num_completed_phases
+        phase = fresh_phase(game.player_names, mode, phase_num) if game.phase is None else game.phase
+        phase_odds = self.phase_value(phase, player_name, mode, phase_num)
+        after_win, after_loss = self._after_phase(game, player_name, mode, phase_num)
+        return GameOdds(phase_odds, after_loss + phase_odds * (after_win - after_loss))
+
+    def _after_phase(self, game, player_name, mode, phase_num):
+        '''chances that player_name wins the game after winning and after losing phase_num'''
+        last_phase_num = game.total_phases - 1
+        if phase_num == last_phase_num:
+            return 1.0, 0.0
+        if mode == "double_or_nothing" and "player" in game.player_names:
+            # the player has to win every phase left, and the dealer just one
+            odds = prod(
+                self.phase_value(fresh_phase(game.player_names, mode, later_phase_num), "player", mode, later_phase_num)
+                for later_phase_num in range(phase_num + 1, game.total_phases)
+            )
+            return (odds, 0.0) if player_name == "player" else (1.0, 1.0 - odds)
+
+        # in story mode, whoever wins the last phase wins the game
+        odds = self.phase_value(fresh_phase(game.player_names, mode, last_phase_num), player_name, mode, last_phase_num)
+        return odds, odds
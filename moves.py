@@ -0,0 +1,194 @@
+from typing import NamedTuple, Optional
+
+from exceptions import GameError
+from items import Items
+
+# chance that expired medicine heals instead of hurting
+MEDICINE_HEAL_CHANCE = 0.4
+
+
+class Move(NamedTuple):
+    '''
+    shoot target, or use item (first stealing it from target with adrenaline
+    if stolen) on the player on, for items used on someone (the jammer)
+    '''
+    item: Optional[Items] = None
+    target: Optional[int] = None
+    stolen: bool = False
+    on: Optional[int] = None
+
+    def describe(self, state) -> str:
+        if self.item is None:
+            return f"shoots {state.player_names[self.target]}"
+        item_name = self.item.name.lower()
+        on = "" if self.on is None else f" on {state.player_names[self.on]}"
+        if self.stolen:
+            return f"steals {item_name} from {state.player_names[self.target]}{on}"
+        return f"uses {item_name}{on}"
+
+    def reseat(self, seats) -> "Move":
+        '''the same move after player i moves to seat seats[i]'''
+        return self._replace(
+            target=None if self.target is None else seats[self.target],
+            on=None if self.on is None else seats[self.on],
+        )
+
+
+def _is_useful(state, user, item) -> bool:
+    '''
+    False if using item now can't possibly help user, so the search can skip it
+
+    holding on to an item is never worse than wasting it, because the same
+    item can still be used later.
+    '''
+    round = state.round
+    current_shell_is_known = round.known_shell(round.num_past_shells) is not None
+    match item:
+        case Items.CIGARETTES:
+            return not state.is_critical(user) and state.charges[user] < state.max_charges
+        case Items.EXPIRED_MEDICINE:
+            return not state.is_critical(user) and state.charges[user] < state.max_charges
+        case Items.HAND_SAW:
+            return not round.gun_is_sawed
+        case Items.HANDCUFFS:
+            other_player = state.next_player(user)
+            return not (round.handcuffed >> other_player & 1)
+        case Items.REMOTE:
+            # with two players left, the next player is the same either way
+            return sum(charges > 0 for charges in state.charges) > 2
+        case Items.MAGNIFYING_GLASS:
+            return not current_shell_is_known
+        case Items.BURNER_PHONE:
+            later_shells = round.future_shell_mask() & ~(1 << round.num_past_shells)
+            known_shells = round.known_live_shells | round.known_blank_shells
+            return bool(later_shells & ~known_shells)
+        case Items.BEER | Items.INVERTER | Items.JAMMER:
+            return True
+        case _:
+            return False
+
+
+def legal_moves(state, prune=True):
+    '''
+    every move the player whose turn it is can make
+
+    with prune, item uses that can't help (see _is_useful) are left out, and
+    each kind of item is only tried once. nothing is left out while an
+    opponent holds adrenaline, since using up an item keeps it from being
+    stolen; stealing is never left out, since it takes the item from them.
+    '''
+    user = state.round.turn
+    prune = prune and not any(
+        Items.ADRENALINE in items
+        for i, items in enumerate(state.items)
+        if i != user
+    )
+    players = [i for i in range(len(state.player_names)) if not state.is_out(i)]
+    moves = [Move(target=target) for target in players]
+    for item in sorted(set(state.items[user])):
+        if item == Items.ADRENALINE:
+            for target in players:
+                if target == user:
+                    continue
+                for stolen_item in sorted(set(state.items[target])):
+                    if stolen_item != Items.ADRENALINE:
+                        moves.extend(_uses(state, user, players, stolen_item, target, prune=False))
+        elif not prune or _is_useful(state, user, item):
+            moves.extend(_uses(state, user, players, item, prune=prune))
+    return moves
+
+
+def _uses(state, user, players, item, stolen_from=None, prune=True):
+    '''the ways user can use item: one, unless it's used on someone'''
+    stolen = stolen_from is not None
+    if item != Items.JAMMER:
+        return [Move(item=item, target=stolen_from, stolen=stolen)]
+    return [
+        Move(item=item, target=stolen_from, stolen=stolen, on=on)
+        for on in players
+        if on != user and not (prune and state.round.handcuffed >> on & 1)
+    ]
+
+
+def outcomes(state, move):
+    '''
+    what can happen after move: a list of (chance, state) pairs, with
+    outcomes that contradict what we know left out
+    '''
+    round = state.round
+    user = round.turn
+    results = []
+
+    def add(chance, make_state):
+        if chance <= 0.0:
+            return
+        try:
+            results.append((chance, make_state()))
+        except GameError:
+            pass
+
+    if move.item is None:
+        live_chance = round.chance_shell_is_live()
+        add(live_chance, lambda: state.shoot(move.target, True))
+        add(1.0 - live_chance, lambda: state.shoot(move.target, False))
+        return results
+
+    stolen_from = move.target if move.stolen else None
+
+    def use(outcome=None):
+        return lambda: state.use_item(user, move.item, outcome, stolen_from=stolen_from, on=move.on)
+
+    match move.item:
+
+        case Items.MAGNIFYING_GLASS | Items.BEER:
+            live_chance = round.chance_shell_is_live()
+            add(live_chance, use(True))
+            add(1.0 - live_chance, use(False))
+
+        case Items.BURNER_PHONE:
+            # the phone tells you about one of the shells after the current one
+            live_chances = round.live_chances()
+            num_later_shells = len(live_chances) - 1
+            if num_later_shells < 1:
+                add(1.0, use())
+            for shells_from_now in range(1, num_later_shells + 1):
+                live_chance = live_chances[shells_from_now]
+                add(live_chance / num_later_shells, use((shells_from_now, True)))
+                add((1.0 - live_chance) / num_later_shells, use((shells_from_now, False)))
+
+        case Items.EXPIRED_MEDICINE:
+            add(MEDICINE_HEAL_CHANCE, use(True))
+            add(1.0 - MEDICINE_HEAL_CHANCE, use(False))
+
+        case _:
+            add(1.0, use())
+
+    return results
+
+
+def order_moves(state, moves, best_move=None):
+    '''
+    sort moves so the ones most likely to be best come first, which lets
+    the search cut off the rest sooner
+    '''
+    round = state.round
+    user = round.turn
+    live_chance = round.chance_shell_is_live()
+
+    def score(move):
+        if move == best_move:
+            return -100
+        if move.item is None:
+            # shoot the opponent with likely live shells, yourself with likely blanks
+            shooting_self = move.target == user
+            return (1.0 - live_chance if shooting_self else live_chance) * -10
+        match move.item:
+            case Items.MAGNIFYING_GLASS | Items.BURNER_PHONE:
+                return -20
+            case Items.HAND_SAW:
+                return -30 if live_chance == 1.0 else 0
+            case Items.CIGARETTES | Items.HANDCUFFS:
+                return -15
+        return 0
+
+    return sorted(moves, key=score)
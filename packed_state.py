@@ -0,0 +1,568 @@
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from exceptions import GameError
+from game_state import PhaseState, Player, RoundState
+from items import Items
+
+# bump whenever a change to the rules or the search changes solved values
+# (or position_key), so saved positions from older versions are no longer
+# used. it lives here rather than in solver so files can be checked against
+# it without importing the solver
+RULES_VERSION = 3
+
+
+def _bit(mask: int, i: int) -> bool:
+    return bool(mask >> i & 1)
+
+
+class PackedRound(NamedTuple):
+    '''
+    immutable RoundState
+
+    shells are numbered from the start of the round; past_live_shells,
+    known_live_shells and known_blank_shells have bit i set for shell i.
+    handcuffed has bit i set for the i-th player of the phase, who skips
+    their next turn (handcuffs and jammer both do this). with is_reversed,
+    turns go backwards through the players (remote).
+
+    current_shell_inverted is set when an inverter was used on a shell
+    nobody has seen: it will fire as the opposite of whatever it was loaded
+    as. RoundState has no inverter, so to_round can't represent it.
+    '''
+    total_live_shells: int
+    total_blank_shells: int
+    num_past_shells: int = 0
+    past_live_shells: int = 0
+    known_live_shells: int = 0
+    known_blank_shells: int = 0
+    turn: int = 0
+    gun_is_sawed: bool = False
+    handcuffed: int = 0
+    current_shell_inverted: bool = False
+    is_reversed: bool = False
+
+    def total_shells(self) -> int:
+        return self.total_live_shells + self.total_blank_shells
+
+    def remaining_shells(self) -> int:
+        return self.total_shells() - self.num_past_shells
+
+    def remaining_live_shells(self) -> int:
+        return self.total_live_shells - self.past_live_shells.bit_count()
+
+    def remaining_blank_shells(self) -> int:
+        return self.remaining_shells() - self.remaining_live_shells()
+
+    def future_shell_mask(self) -> int:
+        return ((1 << self.total_shells()) - 1) & ~((1 << self.num_past_shells) - 1)
+
+    def known_shell(self, i) -> Optional[bool]:
+        if _bit(self.known_live_shells, i):
+            return True
+        if _bit(self.known_blank_shells, i):
+            return False
+        return None
+
+    def assert_future_shell(self, shells_from_now, is_live):
+        if shells_from_now == 0 and self.current_shell_inverted:
+            is_live = not is_live
+        i = self.num_past_shells + shells_from_now
+        if i >= self.total_shells():
+            raise GameError("actually, there aren't enough shells to learn that!")
+        known_shell_is_live = self.known_shell(i)
+        if known_shell_is_live is None:
+            # other shells still to come that are known can't be this one
+            known_later_shells = (self.known_live_shells if is_live else self.known_blank_shells) & self.future_shell_mask()
+            remaining_matching_shells = self.remaining_live_shells() if is_live else self.remaining_blank_shells()
+            if remaining_matching_shells - known_later_shells.bit_count() < 1:
+                raise GameError(f"actually, there are no {"live" if is_live else "blank"} shells left")
+        elif known_shell_is_live != is_live:
+            raise GameError(f"actually, player knows this shell to be {"live" if known_shell_is_live else "blank"}")
+
+    def learn_future_shell(self, shells_from_now, is_live) -> "PackedRound":
+        self.assert_future_shell(shells_from_now, is_live)
+        if shells_from_now == 0 and self.current_shell_inverted:
+            return self._resolve_inversion(is_live).learn_future_shell(0, is_live)
+        bit = 1 << (self.num_past_shells + shells_from_now)
+        if is_live:
+            return self._replace(known_live_shells=self.known_live_shells | bit)
+        return self._replace(known_blank_shells=self.known_blank_shells | bit)
+
+    def chance_shell_is_live(self) -> float:
+        i = self.num_past_shells
+        if i >= self.total_shells():
+            raise GameError("actually, there aren't enough shells to learn that!")
+        known_shell_is_live = self.known_shell(i)
+        if known_shell_is_live is not None:
+            return 1.0 if known_shell_is_live else 0.0
+        future = self.future_shell_mask()
+        known_future_live_shells = (self.known_live_shells & future).bit_count()
+        known_future_shells = known_future_live_shells + (self.known_blank_shells & future).bit_count()
+        unknown_live_shells = self.remaining_live_shells() - known_future_live_shells
+        live_chance = unknown_live_shells / (self.remaining_shells() - known_future_shells)
+        return 1.0 - live_chance if self.current_shell_inverted else live_chance
+
+    def chance_future_shell_is_live(self, shells_from_now) -> float:
+        if shells_from_now == 0:
+            return self.chance_shell_is_live()
+        i = self.num_past_shells + shells_from_now
+        known_shell_is_live = self.known_shell(i)
+        if known_shell_is_live is not None:
+            return 1.0 if known_shell_is_live else 0.0
+
+        # all unknown shells after the current one are equally likely to be live
+        future = self.future_shell_mask() & ~(1 << self.num_past_shells)
+        unknown_live_shells = self.remaining_live_shells() - (self.known_live_shells & future).bit_count()
+        unknown_shells = self.remaining_shells() - (self.known_live_shells & future).bit_count() - (self.known_blank_shells & future).bit_count()
+        current_is_live = self.known_shell(self.num_past_shells)
+        if current_is_live is None:
+            # the current shell is still in the unknown pool, as loaded
+            return unknown_live_shells / unknown_shells
+        return (unknown_live_shells - current_is_live) / (unknown_shells - 1)
+
+    def live_chances(self) -> Tuple[float, ...]:
+        '''
+        chance each remaining shell is live, from the current one on, in one pass
+
+        every order of the unknown shells is equally likely, so each unknown
+        shell has the same chance of being live
+        '''
+        future = self.future_shell_mask()
+        known_live_shells = self.known_live_shells & future
+        known_blank_shells = self.known_blank_shells & future
+        unknown_live_shells = self.remaining_live_shells() - known_live_shells.bit_count()
+        unknown_shells = self.remaining_shells() - known_live_shells.bit_count() - known_blank_shells.bit_count()
+        unknown_live_chance = unknown_live_shells / unknown_shells if unknown_shells else 0.0
+        chances = [
+            1.0 if _bit(known_live_shells, i) else 0.0 if _bit(known_blank_shells, i) else unknown_live_chance
+            for i in range(self.num_past_shells, self.total_shells())
+        ]
+        if self.current_shell_inverted:
+            chances[0] = 1.0 - chances[0]
+        return tuple(chances)
+
+    def invert_shell(self) -> "PackedRound":
+        i = self.num_past_shells
+        known_shell_is_live = self.known_shell(i)
+        if known_shell_is_live is None:
+            return self._replace(current_shell_inverted=not self.current_shell_inverted)
+        bit = 1 << i
+        return self._replace(
+            total_live_shells=self.total_live_shells + (-1 if known_shell_is_live else 1),
+            total_blank_shells=self.total_blank_shells + (1 if known_shell_is_live else -1),
+            known_live_shells=self.known_live_shells ^ bit,
+            known_blank_shells=self.known_blank_shells ^ bit,
+        )
+
+    def _resolve_inversion(self, is_live) -> "PackedRound":
+        '''
+        the inverted current shell turned out to fire as is_live, so it was
+        loaded as the opposite; count it as loaded the way it fires
+        '''
+        return self._replace(
+            total_live_shells=self.total_live_shells + (1 if is_live else -1),
+            total_blank_shells=self.total_blank_shells + (-1 if is_live else 1),
+            current_shell_inverted=False,
+        )
+
+    def eject_shell(self, is_live) -> "PackedRound":
+        self.assert_future_shell(0, is_live)
+        if self.current_shell_inverted:
+            return self._resolve_inversion(is_live).eject_shell(is_live)
+        past_live_shells = self.past_live_shells
+        if is_live:
+            past_live_shells |= 1 << self.num_past_shells
+        return self._replace(num_past_shells=self.num_past_shells + 1, past_live_shells=past_live_shells)
+
+    @classmethod
+    def from_round(cls, round: RoundState, player_names) -> "PackedRound":
+        known_live_shells = 0
+        known_blank_shells = 0
+        for i, is_live in round.known_shells.items():
+            if is_live:
+                known_live_shells |= 1 << i
+            else:
+                known_blank_shells |= 1 << i
+        return cls(
+            total_live_shells=round.total_live_shells,
+            total_blank_shells=round.total_blank_shells,
+            num_past_shells=len(round.past_shells),
+            past_live_shells=sum(1 << i for i, is_live in enumerate(round.past_shells) if is_live),
+            known_live_shells=known_live_shells,
+            known_blank_shells=known_blank_shells,
+            turn=round.turn,
+            gun_is_sawed=round.gun_is_sawed,
+            handcuffed=sum(1 << i for i, name in enumerate(player_names) if name in round.handcuffed_player_names),
+            is_reversed=round.is_reversed,
+        )
+
+    def to_round(self, player_names) -> RoundState:
+        return RoundState(
+            total_live_shells=self.total_live_shells,
+            total_blank_shells=self.total_blank_shells,
+            past_shells=[_bit(self.past_live_shells, i) for i in range(self.num_past_shells)],
+            turn=self.turn,
+            gun_is_sawed=self.gun_is_sawed,
+            handcuffed_player_names=set(name for i, name in enumerate(player_names) if _bit(self.handcuffed, i)),
+            is_reversed=self.is_reversed,
+            known_shells={
+                i: is_live
+                for i in range(self.total_shells())
+                if (is_live := self.known_shell(i)) is not None
+            },
+        )
+
+
+class PackedPhase(NamedTuple):
+    '''
+    immutable PhaseState
+
+    players are referred to by their index in player_names. critical has
+    bit i set if the i-th player is critical. players with no charges left
+    are out: they're skipped, and the phase goes on until one is left.
+    '''
+    player_names: Tuple[str, ...]
+    charges: Tuple[int, ...]
+    max_charges: int
+    critical_charges: int = 0
+    critical: int = 0
+    items: Tuple[Tuple[Items, ...], ...] = ()
+    round: Optional[PackedRound] = None
+    num_completed_rounds: int = 0
+
+    def is_critical(self, i) -> bool:
+        return _bit(self.critical, i)
+
+    def is_out(self, i) -> bool:
+        return self.charges[i] <= 0
+
+    def next_player(self, i) -> int:
+        '''index of the player who plays after the i-th one, skipping anyone who's out'''
+        num_players = len(self.charges)
+        step = -1 if self.round.is_reversed else 1
+        for _ in range(num_players):
+            i = (i + step) % num_players
+            if self.charges[i] > 0:
+                return i
+        return i
+
+    def with_charges(self, i, charges) -> "PackedPhase":
+        return self._replace(charges=self.charges[:i] + (charges,) + self.charges[i+1:])
+
+    def eject_shell(self, is_live) -> "PackedPhase":
+        round = self.round.eject_shell(is_live)
+
+        # if no shells left, end round
+        if round.num_past_shells == round.total_shells():
+            return self._replace(round=None, num_completed_rounds=self.num_completed_rounds + 1)
+        return self._replace(round=round)
+
+    def shoot(self, target, is_live) -> "PackedPhase":
+        '''same rules as PhaseState._shoot'''
+        round = self.round
+        round.assert_future_shell(0, is_live)
+        state = self
+
+        if is_live:
+            if self.is_critical(target):
+                state = state.with_charges(target, 0)
+            else:
+                damage = 2 if round.gun_is_sawed else 1
+                charges = self.charges[target] - damage
+                state = state.with_charges(target, charges)
+                state = state._replace(round=round._replace(gun_is_sawed=False))
+                if charges <= self.critical_charges:
+                    state = state._replace(critical=state.critical | 1 << target)
+
+        state = state.eject_shell(is_live)
+        round = state.round
+        if round is None:
+            return state
+
+        # advance turn, skipping (and uncuffing) anyone who's handcuffed
+        shooter = round.turn
+        if shooter != target or is_live:
+            next_player = state.next_player(shooter)
+            handcuffed = round.handcuffed
+            while _bit(handcuffed, next_player):
+                handcuffed &= ~(1 << next_player)
+                next_player = state.next_player(next_player)
+            state = state._replace(round=round._replace(turn=next_player, handcuffed=handcuffed))
+        return state
+
+    def without_item(self, i, item) -> "PackedPhase":
+        items = list(self.items[i])
+        try:
+            items.remove(item)
+        except ValueError:
+            raise GameError(f"{self.player_names[i]} doesn't have {item.name.lower()}")
+        return self._replace(items=self.items[:i] + (tuple(items),) + self.items[i+1:])
+
+    def use_item(self, user, item, outcome=None, stolen_from=None, on=None) -> "PackedPhase":
+        '''
+        same rules as the item lines in parse_game_line, plus the items the
+        log format doesn't have yet
+
+        outcome is whatever the item revealed or rolled: is_live for glass and
+        beer, (shells_from_now, is_live) for the phone (None for either if
+        nobody says, or there was nothing to hear), and whether the expired
+        medicine healed. with
+        stolen_from, user spends adrenaline to take the item from that player.
+        on is the player the jammer is used on.
+        '''
+        if stolen_from is None:
+            state = self.without_item(user, item)
+        elif item == Items.ADRENALINE:
+            raise GameError("adrenaline can't be stolen")
+        else:
+            state = self.without_item(user, Items.ADRENALINE).without_item(stolen_from, item)
+        round = state.round
+
+        match item:
+
+            case Items.CIGARETTES:
+                if not state.is_critical(user):
+                    state = state.with_charges(user, min(state.max_charges, state.charges[user] + 1))
+
+            case Items.HAND_SAW:
+                state = state._replace(round=round._replace(gun_is_sawed=True))
+
+            case Items.HANDCUFFS:
+                other_player = state.next_player(user)
+                state = state._replace(round=round._replace(handcuffed=round.handcuffed | 1 << other_player))
+
+            case Items.JAMMER:
+                if on is None or on == user or state.is_out(on):
+                    raise GameError("the jammer has to be used on another player who's still in")
+                state = state._replace(round=round._replace(handcuffed=round.handcuffed | 1 << on))
+
+            case Items.REMOTE:
+                state = state._replace(round=round._replace(is_reversed=not round.is_reversed))
+
+            case Items.MAGNIFYING_GLASS:
+                if outcome is not None:
+                    state = state._replace(round=round.learn_future_shell(0, outcome))
+
+            case Items.BEER:
+                state = state.eject_shell(outcome)
+
+            case Items.BURNER_PHONE:
+                if outcome is not None:
+                    shells_from_now, is_live = outcome
+                    state = state._replace(round=round.learn_future_shell(shells_from_now, is_live))
+
+            case Items.EXPIRED_MEDICINE:
+                if outcome:
+                    if not state.is_critical(user):
+                        state = state.with_charges(user, min(state.max_charges, state.charges[user] + 2))
+                else:
+                    charges = state.charges[user] - 1
+                    state = state.with_charges(user, charges)
+                    if charges <= state.critical_charges:
+                        state = state._replace(critical=state.critical | 1 << user)
+
+            case Items.INVERTER:
+                state = state._replace(round=round.invert_shell())
+
+            case _:
+                raise GameError(f"{item.name.lower()} can't be used on its own")
+
+        return state
+
+    @classmethod
+    def from_phase(cls, phase: PhaseState) -> "PackedPhase":
+        player_names = tuple(phase.players)
+        players = phase.players.values()
+        return cls(
+            player_names=player_names,
+            charges=tuple(player.charges for player in players),
+            max_charges=phase.max_charges,
+            critical_charges=phase.critical_charges,
+            critical=sum(1 << i for i, player in enumerate(players) if player.is_critical),
+            items=tuple(tuple(player.items) for player in players),
+            round=None if phase.round is None else PackedRound.from_round(phase.round, player_names),
+            num_completed_rounds=phase.num_completed_rounds,
+        )
+
+    def to_phase(self) -> PhaseState:
+        return PhaseState(
+            players=OrderedDict(
+                (name, Player(charges=self.charges[i], items=list(self.items[i]), is_critical=self.is_critical(i)))
+                for i, name in enumerate(self.player_names)
+            ),
+            max_charges=self.max_charges,
+            critical_charges=self.critical_charges,
+            round=None if self.round is None else self.round.to_round(self.player_names),
+            num_completed_rounds=self.num_completed_rounds,
+        )
+
+
+def _items_as_multisets(state):
+    '''the order items were dealt in doesn't matter'''
+    items = tuple(tuple(sorted(player_items)) for player_items in state.items)
+    return state if items == state.items else state._replace(items=items)
+
+def _drop_spent_shells(state):
+    '''
+    which shells were fired doesn't matter once they're gone, only how many
+    of each kind are left, so number the shells from the current one
+    '''
+    round = state.round
+    if round is None or round.num_past_shells == 0:
+        return state
+    num_past_shells = round.num_past_shells
+    return state._replace(round=round._replace(
+        total_live_shells=round.remaining_live_shells(),
+        total_blank_shells=round.remaining_blank_shells(),
+        num_past_shells=0,
+        past_live_shells=0,
+        known_live_shells=round.known_live_shells >> num_past_shells,
+        known_blank_shells=round.known_blank_shells >> num_past_shells,
+    ))
+
+def _known_by_elimination(live, blank, known_live, known_blank, inverted):
+    '''
+    shells counted from the current one, as (live, blank, known live, known
+    blank, current shell inverted), with the unknown ones marked as known if
+    they must all be live or all be blank
+    '''
+    unknown = ((1 << (live + blank)) - 1) & ~(known_live | known_blank)
+    unknown_live = live - known_live.bit_count()
+    if not unknown or 0 < unknown_live < unknown.bit_count():
+        return live, blank, known_live, known_blank, inverted
+    is_live = unknown_live > 0
+    if inverted and unknown & 1:
+        # it was loaded as the rest were, so it fires as the opposite
+        if is_live:
+            live, blank, known_blank = live - 1, blank + 1, known_blank | 1
+        else:
+            live, blank, known_live = live + 1, blank - 1, known_live | 1
+        unknown &= ~1
+        inverted = False
+    if is_live:
+        return live, blank, known_live | unknown, known_blank, inverted
+    return live, blank, known_live, known_blank | unknown, inverted
+
+def _shells_known_by_elimination(state):
+    '''
+    when the unknown shells left are all live or all blank, everyone knows
+    what each of them is, even if nobody has seen them
+    '''
+    round = state.round
+    if round is None:
+        return state
+    num_past_shells = round.num_past_shells
+    live = round.remaining_live_shells()
+    blank = round.remaining_blank_shells()
+    shells = (
+        live,
+        blank,
+        round.known_live_shells >> num_past_shells,
+        round.known_blank_shells >> num_past_shells,
+        round.current_shell_inverted,
+    )
+    known_shells = _known_by_elimination(*shells)
+    if known_shells == shells:
+        return state
+    new_live, new_blank, known_live, known_blank, inverted = known_shells
+    return state._replace(round=round._replace(
+        total_live_shells=round.total_live_shells + new_live - live,
+        total_blank_shells=round.total_blank_shells + new_blank - blank,
+        known_live_shells=round.known_live_shells | known_live << num_past_shells,
+        known_blank_shells=round.known_blank_shells | known_blank << num_past_shells,
+        current_shell_inverted=inverted,
+    ))
+
+# ways positions can differ without it changing anything for the rest of
+# the round, in the order normalize applies them
+NORMALIZATIONS = {
+    "items as multisets": _items_as_multisets,
+    "spent shells dropped": _drop_spent_shells,
+    "shells known by elimination": _shells_known_by_elimination,
+}
+
+def normalize(state, rules=NORMALIZATIONS):
+    '''
+    the one position that stands for every position that's the same as
+    state apart from things that can't change how the round goes (see
+    NORMALIZATIONS, or pass the names of just some of them as rules)
+    '''
+    for rule in rules:
+        state = NORMALIZATIONS[rule](state)
+    return state
+
+
+def canonical_seats(state, player):
+    '''
+    the players in the order position_key lists them, or None if that's
+    the order they're already in
+
+    player comes first, then everyone else in the order they take turns.
+    positions that are the same apart from where everyone sits (or which
+    way turns go) end up with the same key, since they're worth the same to
+    player when everyone else plays against them.
+    '''
+    num_players = len(state.charges)
+    if num_players == 2:
+        return None if player == 0 else (1, 0)
+    step = -1 if state.round.is_reversed else 1
+    seats = tuple((player + step * i) % num_players for i in range(num_players))
+    return None if seats == tuple(range(num_players)) else seats
+
+
+def position_key(state, player, seats=None):
+    '''
+    reduce a position to what the rest of the round depends on
+
+    two positions with the same key have the same win probability for the
+    player with index player, however the round got there: the key is made
+    from the normalized position, with everyone in their canonical seats.
+    seats is canonical_seats(state, player), if it's already been worked out.
+    '''
+    # the same steps as normalize, without making new states, since this
+    # runs for every position searched
+    round = state.round
+    num_past_shells = round.num_past_shells
+    live = round.total_live_shells - round.past_live_shells.bit_count()
+    shells = _known_by_elimination(
+        live,
+        round.total_blank_shells + round.total_live_shells - num_past_shells - live,
+        round.known_live_shells >> num_past_shells,
+        round.known_blank_shells >> num_past_shells,
+        round.current_shell_inverted,
+    )
+    charges = state.charges
+    critical = state.critical
+    handcuffed = round.handcuffed
+    turn = round.turn
+    items = tuple(player_items if len(player_items) < 2 else tuple(sorted(player_items)) for player_items in state.items)
+    if seats is None and (player or len(charges) > 2):
+        seats = canonical_seats(state, player)
+
+    if len(charges) > 2:
+        # anyone who's out can't do anything anymore, whatever they have
+        seats = seats or tuple(range(len(charges)))
+        charges = tuple(max(0, charges[seat]) for seat in seats)
+        critical = sum(1 << i for i, seat in enumerate(seats) if charges[i] and critical >> seat & 1)
+        handcuffed = sum(1 << i for i, seat in enumerate(seats) if charges[i] and handcuffed >> seat & 1)
+        turn = seats.index(turn)
+        items = tuple(items[seat] if charges[i] else () for i, seat in enumerate(seats))
+    elif seats is not None:
+        charges = (charges[1], charges[0])
+        critical = (critical >> 1 & 1) | (critical & 1) << 1
+        handcuffed = (handcuffed >> 1 & 1) | (handcuffed & 1) << 1
+        turn = 1 - turn
+        items = (items[1], items[0])
+
+    return (
+        state.max_charges,
+        state.critical_charges,
+        charges,
+        critical,
+        shells,
+        round.gun_is_sawed,
+        handcuffed,
+        turn,
+        items,
+    )
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 
-from argparse import ArgumentParser, FileType
+import re
 from collections import OrderedDict
-from copy import deepcopy
-from sys import exit, stderr
+from sys import exit, stderr, stdin
+from time import sleep
 
 from exceptions import GameError, TurnError
 from game_state import GameState, PhaseState, Player, RoundState
 from items import Items
 
+# the solver (and whatever it needs) is only imported by the first odds
+# query, so logs without any, and --validate-only, start faster
+
 cardinal_to_ordinal = {
     "second": 1,
     "third": 2,
@@ -24,8 +27,10 @@ items_by_name = {
     "cigs": Items.CIGARETTES,
     "cuffs": Items.HANDCUFFS,
     "glass": Items.MAGNIFYING_GLASS,
+    "jammer": Items.JAMMER,
     "knife": Items.HAND_SAW,
     "phone": Items.BURNER_PHONE,
+    "remote": Items.REMOTE,
 }
 
 story_mode_items = set([
@@ -84,34 +89,43 @@ class CheckFailed(LogParseError):
     pass
 
 
+# commas, dots, and equals signs are words of their own
+tokenize = re.compile(r"[,.=]|[^\s,.=]+").findall
+
+# estimates odds queries instead of default_solver if set (see rollouts.py)
+rollout_evaluator = None
+
+# attributes to set on default_solver before it answers its first query
+solver_settings = {}
+
+# check odds queries are well-formed without answering them
+validate_only = False
+
+# answers game odds queries; made by the first one (see game_value.py)
+game_evaluator = None
+rounds_ahead = None
+deal_items = False
+
+
 def parse_line(state: GameState, line):
     line = line.strip()
 
     # ignore comments
-    if line.startswith("#"):
+    if not line or line.startswith("#"):
         return state
 
     # separate lines conjoined by a semicolon
-    conjoined_lines = line.split(";")
-    if len(conjoined_lines) > 1:
-        for conjoined_line in conjoined_lines:
+    if ";" in line:
+        for conjoined_line in line.split(";"):
             state = parse_line(state, conjoined_line)
         return state
 
-    if not line:
-        return state
-
-    # treat commas, dots, and equals signs as separate words
-    for c in ',.=':
-        line = line.replace(c, f" {c} ")
+    words = tokenize(line)
 
-    words = line.split()
-
-    try:
+    # queries check the state instead of changing it
+    if words[0] == "!check" or words[1:2] == ["wins"]:
         check_query_line(state, words)
         return state
-    except NoMatch:
-        pass
 
     # TODO: handle repeated games in double-or-nothing mode
     if state.winner is not None:
@@ -125,19 +139,31 @@ def parse_line(state: GameState, line):
         # TODO: maybe give context that we can only accept round setup commands?
         return parse_round_setup_line(state, words)
 
-    if (words[0] == "dealer") == state.phase.round.is_players_turn:
+    # only moves have to wait for their turn
+    if words[1:2] in (["shoots"], ["uses"]) and words[0] != state.phase.current_player_name():
         raise TurnError()
 
     return parse_game_line(state, words)
 
 
 def parse_game_setup_line(old_state: GameState, words) -> GameState:
-    new_state = deepcopy(old_state)
+    new_state = old_state.copy()
     match words:
 
         case ["player", "uses", "pills"]:
             new_state.is_double_or_nothing_mode = True
 
+        # multiplayer: everyone at the table, in turn order
+        case ["players", *separated_player_names]:
+            if new_state.num_completed_phases != 0:
+                raise SetupError("players can only be set before the first phase")
+
+            # skip separators (odd-numbered elements)
+            player_names = separated_player_names[::2]
+            if len(player_names) < 2 or len(set(player_names)) != len(player_names):
+                raise SetupError("expected at least two different players")
+            new_state.player_names = player_names
+
         case ["phase", phase_name, ",", _max_charges, "charges", *more] | ["phase", phase_name, ",", _max_charges, "charge", *more]:
             # phase in log: one-indexed tally numerals
             # phase_num here: zero-indexed int
@@ -176,7 +202,7 @@ def parse_game_setup_line(old_state: GameState, words) -> GameState:
     return new_state
 
 def parse_round_setup_line(old_state: GameState, words) -> GameState:
-    new_state = deepcopy(old_state)
+    new_state = old_state.copy()
     match words:
 
         # just for decoration
@@ -206,11 +232,13 @@ def parse_round_setup_line(old_state: GameState, words) -> GameState:
             total_blank_shells = int(_total_blank_shells)
             if total_live_shells + total_blank_shells > 8:
                 raise GameError("too many shells in the chamber! max 8 per round")
-            if 0 in (total_live_shells, total_blank_shells):
+            if total_live_shells < 1 or total_blank_shells < 1:
                 raise GameError("there must be at least one live and one blank shell per round")
             new_state.phase.round = RoundState(
                 total_live_shells=total_live_shells,
                 total_blank_shells=total_blank_shells,
+                # the first player who's still in goes first
+                turn=new_state.phase.next_player(len(new_state.phase.players) - 1),
             )
 
         case _:
@@ -218,10 +246,51 @@ def parse_round_setup_line(old_state: GameState, words) -> GameState:
     return new_state
 
 def check_query_line(state: GameState, words) -> None:
+    global game_evaluator
     match words:
 
+        case ["!check", "shell", "odds"]:
+            if state.phase is None or state.phase.round is None:
+                raise InvalidLine("no round is in progress")
+            if validate_only:
+                return
+            # needs numpy, so only imported for this query
+            from beliefs import ShellBeliefs
+            live_chances = ShellBeliefs.from_round(state.phase.round).live_chances()
+            print("shell odds:", " ".join(f"{live_chance:.2f}" for live_chance in live_chances))
+
+        case ["!check", player_name, "game", "odds"]:
+            if player_name not in state.player_names:
+                raise InvalidLine(f"no such player {player_name}")
+            if len(state.player_names) != 2:
+                raise InvalidLine("game odds are only worked out for two players")
+            if validate_only:
+                return
+            if game_evaluator is None:
+                from game_value import DEFAULT_ROUNDS_AHEAD, GameEvaluator
+                game_evaluator = GameEvaluator(DEFAULT_ROUNDS_AHEAD if rounds_ahead is None else rounds_ahead, deal_items=deal_items)
+            print(player_name, "game odds:", game_evaluator.win_probabilities(state, player_name))
+            print("game evaluator:", game_evaluator, file=stderr)
+
         case ["!check", player_name, "odds"]:
-            print(player_name, "odds:", state.phase.win_probability(player_name))
+            if state.phase is None:
+                raise InvalidLine("no phase is in progress")
+            if player_name not in state.phase.players:
+                raise InvalidLine(f"no such player {player_name}")
+            if validate_only:
+                return
+            if rollout_evaluator is not None:
+                print(player_name, "odds:", rollout_evaluator.win_probability(state.phase, player_name))
+                return
+            default_solver = odds_solver()
+            print(player_name, "odds:", state.phase.win_probability(player_name, solver=default_solver))
+            print("solver cache:", default_solver.table, file=stderr)
+            if default_solver.last_deepening is not None:
+                print("search:", default_solver.last_deepening, file=stderr)
+            if default_solver.store is not None:
+                print("saved positions:", default_solver.store, file=stderr)
+            if default_solver.tablebase is not None:
+                print("tablebase:", default_solver.tablebase, file=stderr)
 
         case ["!check", expected_winner_name, "charges", "=", _expected_value]:
             expected_value = int(_expected_value)
@@ -294,8 +363,18 @@ def check_query_line(state: GameState, words) -> None:
         case _:
             raise NoMatch("expecting query line")
 
+def odds_solver():
+    '''default_solver, imported and set up with solver_settings the first time'''
+    from solver import default_solver
+    if solver_settings:
+        for name, value in solver_settings.items():
+            setattr(default_solver, name, value)
+        solver_settings.clear()
+    return default_solver
+
+
 def parse_game_line(old_state: GameState, words) -> GameState:
-    new_state = deepcopy(old_state)
+    new_state = old_state.copy()
     match words:
         # TODO check that the shell type doesn't clash with a shell we just saw using the glass
         case [player_name, "shoots", target_name, ",", _shell_type]:
@@ -304,6 +383,10 @@ def parse_game_line(old_state: GameState, words) -> GameState:
             if target_name == "self":
                 target_name = player_name
             is_live = (_shell_type == "live")
+            if target_name not in new_state.phase.players:
+                raise InvalidLine(f"no such player {target_name}")
+            if new_state.phase.players[target_name].charges <= 0:
+                raise GameError(f"{target_name} is already out")
 
             new_state.shoot(target_name, is_live)
 
@@ -316,12 +399,14 @@ def parse_game_line(old_state: GameState, words) -> GameState:
 
             match words:
 
-                case [player_name, "uses", "cigs"]:
-                    if not new_state.phase.players[player_name].is_critical:
-                        new_state.phase.players[player_name].charges = min(
-                            new_state.phase.max_charges,
-                            new_state.phase.players[player_name].charges + 1,
-                        )
+                case [player_name, "uses", "cigs"] | [player_name, "uses", "knife"] | [player_name, "uses", "cuffs"] | [player_name, "uses", "remote"]:
+                    new_state.phase.use_item(player_name, item)
+
+                case [player_name, "uses", "jammer", "on", target_name]:
+                    target = new_state.phase.players.get(target_name)
+                    if target_name == player_name or target is None or target.charges <= 0:
+                        raise GameError(f"can't jam {target_name}")
+                    new_state.phase.use_item(player_name, item, target_name=target_name)
 
                 case [player_name, "uses", "phone"]:
                     if player_name == "player":
@@ -337,14 +422,7 @@ def parse_game_line(old_state: GameState, words) -> GameState:
                         raise LogParseError("unknown cardinal (use 'second', 'third', etc.)")
                     if player_name != "player":
                         raise LogParseError("too much information: we shouldn't know what they see")
-                    new_state.phase.round.learn_future_shell(shells_from_now, is_live)
-
-                case [player_name, "uses", "knife"]:
-                    new_state.phase.round.gun_is_sawed = True
-
-                case [player_name, "uses", "cuffs"]:
-                    other_player = "dealer" if player_name == "player" else "player"
-                    new_state.phase.round.handcuffed_player_names.add(other_player)
+                    new_state.phase.use_item(player_name, item, is_live, shells_from_now)
 
                 case [player_name, "uses", "glass"]:
                     if player_name == "player":
@@ -356,11 +434,11 @@ def parse_game_line(old_state: GameState, words) -> GameState:
                     if player_name != "player":
                         raise LogParseError("too much information: we shouldn't know what they see")
                     is_live = _shell_type == "live"
-                    new_state.phase.round.learn_future_shell(0, is_live)
+                    new_state.phase.use_item(player_name, item, is_live)
 
                 case [player_name, "uses", "beer", ",", "ejects", _shell_type]:
                     is_live = _shell_type == "live"
-                    new_state.phase.eject_shell(is_live)
+                    new_state.phase.use_item(player_name, item, is_live)
 
                 case _:
                     raise NoMatch("expecting game line")
@@ -371,13 +449,35 @@ def parse_game_line(old_state: GameState, words) -> GameState:
     return new_state
 
 
-def parse_logfile(f):
+def parse_logfile(f, checkpoints=None):
+    '''
+    validate a log, printing whether it's ok (and the answers to its queries)
+
+    with checkpoints (see checkpoints.py), parsing starts from the last
+    state saved for the lines the log starts with, and saves new states as it
+    goes. queries before that state aren't answered again.
+    '''
     game_state = GameState(player_names=["player", "dealer"])
-    for i, line in enumerate(f):
+    lines = f
+    start = 0
+    if checkpoints is not None:
+        from checkpoints import prefix_hashes
+        lines = f.readlines()
+        hashes = list(prefix_hashes(lines))
+        start, saved_state = checkpoints.resume(hashes)
+        if saved_state is not None:
+            game_state = saved_state
+            print(f"{f.name} resumed after line {start}", file=stderr)
+    for i, line in enumerate(lines[start:] if start else lines, start):
         try:
-            game_state = parse_line(game_state, line)
+            new_state = parse_line(game_state, line)
+            if checkpoints is not None and checkpoints.should_checkpoint(i + 1, game_state, new_state):
+                checkpoints.put(hashes[i], i + 1, new_state)
+            game_state = new_state
         except Exception as e:
-            print(f"{logfile.name} failed", file=stderr)
+            if checkpoints is not None:
+                checkpoints.flush()
+            print(f"{f.name} failed", file=stderr)
             print("line", i+1, file=stderr)
             print(line.strip(), file=stderr)
             if isinstance(e, LogParseError) or isinstance(e, GameError):
@@ -385,19 +485,124 @@ def parse_logfile(f):
                 return
             else:
                 raise e
-    print(f"{logfile.name} ok", file=stderr)
+    if checkpoints is not None:
+        checkpoints.flush()
+    print(f"{f.name} ok", file=stderr)
+    return game_state
+
+
+def follow_logfile(f, odds_player_names=(), poll_interval=0.1):
+    '''
+    validate a log while it's being written, like tail -f
+
+    each new line is applied to the state built from the lines before it. a
+    line that doesn't validate is reported and skipped, so it can be fixed by
+    writing a corrected line after it. after every move, the odds of each of
+    odds_player_names are printed. stops at the end of stdin, or once the game
+    is over.
+    '''
+    game_state = GameState(player_names=["player", "dealer"])
+    partial_line = ""
+    i = 0
+    while game_state.winner is None:
+        partial_line += f.readline()
+
+        # wait for the rest of the line (or the file) to be written
+        if not partial_line.endswith("\n"):
+            if f is stdin and not partial_line:
+                break
+            if f is not stdin:
+                sleep(poll_interval)
+                continue
+
+        line, partial_line = partial_line, ""
+        i += 1
+        try:
+            new_state = parse_line(game_state, line)
+        except (LogParseError, GameError) as e:
+            print(f"{f.name} line {i} rejected: {line.strip()}", file=stderr)
+            print(e, file=stderr)
+            continue
+
+        moved = new_state is not game_state
+        game_state = new_state
+        if moved and game_state.phase is not None and game_state.phase.round is not None:
+            for player_name in odds_player_names:
+                if rollout_evaluator is not None:
+                    odds = rollout_evaluator.win_probability(game_state.phase, player_name)
+                else:
+                    odds = game_state.phase.win_probability(player_name, solver=odds_solver())
+                print(player_name, "odds:", odds, flush=True)
+
+    print(f"{f.name} ok", file=stderr)
     return game_state
 
 
 def parse_args():
+    # only the command line needs argparse, not the modules that import this one
+    from argparse import ArgumentParser, FileType
     parser = ArgumentParser()
     parser.add_argument("LOGFILE", nargs="+", type=FileType('r'))
+    parser.add_argument("--validate-only", action="store_true", help="check odds queries are well-formed without answering them, so the solver is never imported")
+    parser.add_argument("--workers", type=int, default=1, help="processes to solve odds queries with")
+    parser.add_argument("--split-depth", type=int, default=1, help="how many moves deep to split odds queries between workers")
+    parser.add_argument("--cache", help="sqlite file to save solved positions in and reuse them from (see position_store.py)")
+    parser.add_argument("--tablebase", help="endgame tablebase to look positions up in (see tablebase.py)")
+    parser.add_argument("--checkpoints", metavar="PATH", help="sqlite file to save states partway through logs in, so parsing them again resumes where they last changed (see checkpoints.py)")
+    parser.add_argument("--trace", metavar="PATH", help="append a JSON line describing each odds search to PATH")
+    parser.add_argument("--flamegraph", metavar="PATH", help="write the odds searches to PATH as folded stacks for flamegraph.pl")
+    parser.add_argument("--rollouts", metavar="POLICY", choices=["random", "greedy"], help="estimate odds from random playouts following POLICY (random or greedy) instead of solving them (see rollouts.py)")
+    parser.add_argument("--samples", type=int, help="with --rollouts, playouts per odds query")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS", help="stop each odds query after about SECONDS with the best estimate so far (searching one move deeper at a time, or with --rollouts, playing out more games)")
+    parser.add_argument("--rounds-ahead", type=int, help="for game odds queries, how many rounds after the current one to solve before guessing (default 1; see game_value.py)")
+    parser.add_argument("--deal-items", action="store_true", help="for game odds queries, deal new items in the rounds solved after the current one, as well as loading new shells (much slower)")
+    parser.add_argument("--follow", action="store_true", help="keep validating LOGFILE (or - for stdin) as lines are appended")
+    parser.add_argument("--odds", metavar="PLAYER", action="append", default=[], help="with --follow, print PLAYER's odds after every move")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
+    validate_only = args.validate_only
+    if validate_only and args.odds:
+        exit("--validate-only doesn't answer --odds")
+    solver_settings.update(workers=args.workers, split_depth=args.split_depth)
+    store = trace = None
+    if args.cache is not None:
+        from position_store import PositionStore
+        store = solver_settings["store"] = PositionStore(args.cache)
+    if args.tablebase is not None:
+        from tablebase import Tablebase
+        solver_settings["tablebase"] = Tablebase.load(args.tablebase)
+    if args.trace is not None or args.flamegraph is not None:
+        from search_trace import SearchTrace
+        trace = solver_settings["trace"] = SearchTrace(json_path=args.trace, folded_path=args.flamegraph)
+    rounds_ahead = args.rounds_ahead
+    deal_items = args.deal_items
+    if args.rollouts is not None:
+        from rollouts import RolloutEvaluator
+        rollout_evaluator = RolloutEvaluator(args.rollouts, args.samples, args.time_budget, args.workers)
+    else:
+        solver_settings["time_budget"] = args.time_budget
+    if args.follow:
+        if len(args.LOGFILE) != 1:
+            exit("--follow takes one LOGFILE")
+        try:
+            follow_logfile(args.LOGFILE[0], args.odds)
+        except KeyboardInterrupt:
+            pass
+        args.LOGFILE = []
+    checkpoints = None
+    if args.checkpoints is not None:
+        from checkpoints import CheckpointStore
+        checkpoints = CheckpointStore(args.checkpoints)
     for logfile in args.LOGFILE:
-        game = parse_logfile(logfile)
+        game = parse_logfile(logfile, checkpoints)
         if not game:
             exit(1)
+    if checkpoints is not None:
+        checkpoints.close()
+    if store is not None:
+        store.close()
+    if trace is not None:
+        trace.close()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import struct
+import sys
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+
+from items import Items
+from moves import Move, legal_moves, outcomes
+from packed_state import RULES_VERSION, PackedPhase, PackedRound, position_key
+from position_store import encode_key
+
+MAGIC = b"BRPT"
+FORMAT_VERSION = 2
+
+# magic, format version, rules version, number of positions
+HEADER = struct.Struct("<4sIIQ")
+
+PLAYER_NAMES = ("player", "dealer")
+
+# a move's target or item, when it has none
+_NONE = 0x7f
+_STOLEN = 0x80
+
+
+def hash_position(state):
+    '''
+    the position from the point of view of the player whose turn it is, as
+    a 64-bit int
+
+    it's a hash of position_key, so two different positions could collide,
+    but with the number of positions a table can hold, it's very unlikely
+    '''
+    key = encode_key(position_key(state, state.round.turn))
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def pack_move(move):
+    '''a move as a uint32: its item, target, and who it's used on (for jammers), a byte each'''
+    item = _NONE if move.item is None else int(move.item)
+    target = _NONE if move.target is None else move.target
+    on = _NONE if move.on is None else move.on
+    return on << 16 | item << 8 | target | (_STOLEN if move.stolen else 0)
+
+def unpack_move(packed):
+    on = packed >> 16
+    item = packed >> 8 & 0xff
+    target = packed & ~_STOLEN & 0xff
+    return Move(
+        item=None if item == _NONE else Items(item),
+        target=None if target == _NONE else target,
+        stolen=bool(packed & _STOLEN),
+        on=None if on == _NONE else on,
+    )
+
+
+class PolicyTable:
+    '''
+    the best move and its win probability for every position reachable from
+    some round setups, loaded from a file made by generate
+
+    the file is a header followed by the sorted position hashes (uint64),
+    the win probabilities for the player to move (float64), and their best
+    moves (uint32), so lookups are a binary search and nothing has to be
+    solved. reading one doesn't import the solver.
+    '''
+
+    def __init__(self, keys, values, moves, rules_version):
+        self.keys = keys
+        self.values = values
+        self.moves = moves
+        self.rules_version = rules_version
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self)} positions"
+
+    def get(self, phase):
+        '''(best move, win probability) for whoever's turn it is in phase, or None if it's not in the table'''
+        state = phase if isinstance(phase, PackedPhase) else PackedPhase.from_phase(phase)
+        key = hash_position(state)
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return unpack_move(self.moves[i]), self.values[i]
+
+    @classmethod
+    def load(cls, path, rules_version=RULES_VERSION):
+        '''
+        read a table, checking it was made under rules_version (the current
+        one, unless the caller passes another, or None to skip the check)
+        '''
+        with open(path, "rb") as f:
+            magic, format_version, file_rules_version, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or format_version != FORMAT_VERSION:
+                raise ValueError(f"{path} isn't a policy table")
+            if rules_version is not None and file_rules_version != rules_version:
+                raise ValueError(f"{path} was built for rules version {file_rules_version}, not {rules_version}")
+            keys = array("Q")
+            keys.fromfile(f, count)
+            values = array("d")
+            values.fromfile(f, count)
+            moves = array("I")
+            moves.fromfile(f, count)
+        return cls(keys, values, moves, file_rules_version)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.rules_version, len(self)))
+            self.keys.tofile(f)
+            self.values.tofile(f)
+            self.moves.tofile(f)
+
+
+def reachable_positions(state):
+    '''
+    every position that can come up before the round ends, starting from
+    state, once each
+
+    every move is followed, even ones the solver would never make, since
+    the table has to cover whatever the players actually do
+    '''
+    seen = set()
+    stack = [state]
+    while stack:
+        state = stack.pop()
+        if state.round is None or sum(charges > 0 for charges in state.charges) <= 1:
+            continue
+        key = hash_position(state)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield state
+        for move in legal_moves(state, prune=False):
+            stack.extend(child for _, child in outcomes(state, move))
+
+
+def generate(setups):
+    '''solve every position reachable from the round setups (PackedPhases)'''
+    from solver import Solver, TranspositionTable
+    solver = Solver(table=TranspositionTable(max_size=None))
+    solved = {}
+    for setup in setups:
+        for state in reachable_positions(setup):
+            mover = state.round.turn
+            value = solver.value(state, mover)
+            move = solver.best_move(state, state.player_names[mover])
+            solved[hash_position(state)] = (value, pack_move(move))
+    keys = array("Q", sorted(solved))
+    values = array("d", (solved[key][0] for key in keys))
+    moves = array("I", (solved[key][1] for key in keys))
+    return PolicyTable(keys, values, moves, RULES_VERSION)
+
+
+def check(table, setups):
+    '''
+    solve every position reachable from the round setups again, with a
+    fresh solver, and return a message for each one where table disagrees
+
+    a move other than Solver.best_move is fine if it's worth just as much,
+    since ties can be broken either way
+    '''
+    from solver import Solver, TranspositionTable
+    solver = Solver(table=TranspositionTable(max_size=None))
+    problems = []
+    for setup in setups:
+        for state in reachable_positions(setup):
+            mover = state.round.turn
+            entry = table.get(state)
+            if entry is None:
+                problems.append(f"{position_key(state, mover)}: missing")
+                continue
+            move, value = entry
+            expected = solver.value(state, mover)
+            if abs(value - expected) > 1e-9:
+                problems.append(f"{position_key(state, mover)}: worth {value}, not {expected}")
+            elif move != solver.best_move(state, state.player_names[mover]):
+                move_value = sum(chance * solver.value(child, mover) for chance, child in outcomes(state, move))
+                if abs(move_value - expected) > 1e-9:
+                    problems.append(f"{position_key(state, mover)}: {move} is worth {move_value}, not {expected}")
+    return problems
+
+
+def parse_args():
+    parser = ArgumentParser(description="build a table of the best move in every position reachable from a round setup")
+    parser.add_argument("OUTFILE")
+    parser.add_argument("--charges", type=int, nargs=2, default=[2, 2], metavar=("PLAYER", "DEALER"))
+    parser.add_argument("--max-charges", type=int, help="defaults to the most charges either player has")
+    parser.add_argument("--critical-charges", type=int, default=0)
+    parser.add_argument("--live", type=int, nargs="+", default=[1], help="live shells loaded (more than one for several setups)")
+    parser.add_argument("--blank", type=int, nargs="+", default=[1], help="blank shells loaded (more than one for several setups)")
+    parser.add_argument("--player-items", nargs="*", default=[], metavar="ITEM", help="like glass or knife, as in logs")
+    parser.add_argument("--dealer-items", nargs="*", default=[], metavar="ITEM")
+    parser.add_argument("--check", action="store_true", help="load OUTFILE back and check every position against the solver (exits non-zero if any disagree)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from parse_log import items_by_name
+    args = parse_args()
+    max_charges = max(args.charges) if args.max_charges is None else args.max_charges
+    items = tuple(
+        tuple(sorted(items_by_name[name] for name in names))
+        for names in (args.player_items, args.dealer_items)
+    )
+    setups = [
+        PackedPhase(
+            player_names=PLAYER_NAMES,
+            charges=tuple(args.charges),
+            max_charges=max_charges,
+            critical_charges=args.critical_charges,
+            critical=sum(1 << i for i, charges in enumerate(args.charges) if charges <= args.critical_charges),
+            items=items,
+            round=PackedRound(total_live_shells=live, total_blank_shells=blank),
+        )
+        for live in args.live
+        for blank in args.blank
+        if 1 <= live + blank <= 8
+    ]
+    table = generate(setups)
+    table.save(args.OUTFILE)
+    print(len(table), "positions saved to", args.OUTFILE)
+    if args.check:
+        problems = check(PolicyTable.load(args.OUTFILE), setups)
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} of {len(table)} positions disagree with the solver")
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+from game_state import PhaseState, Player, RoundState
+
+
+def encode_key(key) -> str:
+    '''position_key as text that's the same in every process and every run'''
+    return json.dumps(key, separators=(",", ":"))
+
+
+class PositionStore:
+    '''
+    solved positions saved in an sqlite database, so later runs and other
+    processes don't solve them again
+
+    only exact values are saved, keyed by position_key and the rules version
+    they were solved under. writes are buffered until flush.
+    '''
+
+    def __init__(self, path, rules_version=None):
+        if rules_version is None:
+            from solver import RULES_VERSION as rules_version
+        self.path = path
+        self.rules_version = rules_version
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS positions (
+                rules_version INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (rules_version, key)
+            ) WITHOUT ROWID
+        ''')
+        self.connection.commit()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        encoded_key = encode_key(key)
+        try:
+            value = self.pending[encoded_key]
+        except KeyError:
+            row = self.connection.execute(
+                "SELECT value FROM positions WHERE rules_version = ? AND key = ?",
+                (self.rules_version, encoded_key),
+            ).fetchone()
+            value = None if row is None else row[0]
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.pending[encode_key(key)] = value
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO positions (rules_version, key, value) VALUES (?, ?, ?)",
+            ((self.rules_version, key, value) for key, value in self.pending.items()),
+        )
+        self.connection.commit()
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM positions WHERE rules_version = ?",
+            (self.rules_version,),
+        ).fetchone()[0]
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self)} saved positions in {self.path}"
+
+    def counts_by_rules_version(self):
+        return self.connection.execute(
+            "SELECT rules_version, COUNT(*) FROM positions GROUP BY rules_version ORDER BY rules_version"
+        ).fetchall()
+
+    def compact(self):
+        '''drop positions solved under other rules versions and reclaim their space'''
+        self.flush()
+        deleted = self.connection.execute(
+            "DELETE FROM positions WHERE rules_version != ?",
+            (self.rules_version,),
+        ).rowcount
+        self.connection.commit()
+        self.connection.execute("VACUUM")
+        return deleted
+
+
+def opening_phases(max_charges, critical_charges=0):
+    '''every round start with no items and no damage taken, up to max_charges'''
+    for charges in range(1, max_charges + 1):
+        for total_live_shells in range(1, 8):
+            for total_blank_shells in range(1, 9 - total_live_shells):
+                yield PhaseState(
+                    players=OrderedDict(
+                        (name, Player(charges=charges))
+                        for name in ("player", "dealer")
+                    ),
+                    max_charges=charges,
+                    critical_charges=critical_charges if critical_charges < charges else 0,
+                    round=RoundState(
+                        total_live_shells=total_live_shells,
+                        total_blank_shells=total_blank_shells,
+                    ),
+                )
+
+
+def warm(store, max_charges, critical_charges, workers):
+    from solver import Solver
+    solver = Solver(store=store, workers=workers)
+    for phase in opening_phases(max_charges, critical_charges):
+        for player_name in phase.players:
+            solver.win_probability(phase, player_name)
+    store.flush()
+
+
+def parse_args():
+    parser = ArgumentParser(description="manage the solved-position cache")
+    parser.add_argument("CACHE", help="path to the sqlite cache file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    warm_parser = commands.add_parser("warm", help="solve every itemless round opening")
+    warm_parser.add_argument("--max-charges", type=int, default=4)
+    warm_parser.add_argument("--critical-charges", type=int, default=0)
+    warm_parser.add_argument("--workers", type=int, default=1)
+
+    commands.add_parser("info", help="show what's in the cache")
+    commands.add_parser("compact", help="drop positions from old rules versions and reclaim space")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = PositionStore(args.CACHE)
+    match args.command:
+
+        case "warm":
+            warm(store, args.max_charges, args.critical_charges, args.workers)
+            print(len(store), "positions saved")
+
+        case "info":
+            print(args.CACHE, os.path.getsize(args.CACHE), "bytes")
+            for rules_version, count in store.counts_by_rules_version():
+                current = " (current)" if rules_version == store.rules_version else ""
+                print(f"rules version {rules_version}{current}: {count} positions")
+
+        case "compact":
+            print(store.compact(), "stale positions dropped")
+            print(args.CACHE, os.path.getsize(args.CACHE), "bytes")
+
+    store.close()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+
+import struct
+from argparse import ArgumentParser
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from enum import IntEnum
+from mmap import ACCESS_READ, mmap
+from sys import exit, stderr
+from tempfile import TemporaryFile
+from typing import NamedTuple
+
+from game_state import GameState, PhaseState, Player, RoundState
+from items import Items
+from exceptions import GameError
+from parse_log import LogParseError, cardinal_to_ordinal, items_by_name, parse_line, tokenize
+
+MAGIC = b"BRPL"
+VERSION = 2
+
+# magic, version, number of records, number of rounds
+HEADER = struct.Struct("<4sIII")
+
+# opcode, actor, arg, value, line number in the text log
+RECORD = struct.Struct("<BBBBI")
+
+# the state just before each round's shells are loaded (see RoundIndex)
+ROUND_INDEX = struct.Struct("<IIBBBBBBB2B8s8s")
+
+# value of a record whose outcome the log doesn't say
+UNKNOWN = 0xff
+
+# no item, in a round index's item slots
+NO_ITEM = 0xff
+
+PLAYER_NAMES = ("player", "dealer")
+
+ITEM_NAMES = {item: name for name, item in items_by_name.items()}
+
+CARDINALS = {shells_from_now: cardinal for cardinal, shells_from_now in cardinal_to_ordinal.items()}
+
+
+class Op(IntEnum):
+    PILLS = 0       # actor takes the pills (double or nothing)
+    PHASE = 1       # actor: phase number (from 0), arg: max charges, value: critical charges
+    ROUND = 2       # arg: phase number, value: round number (both from 0)
+    GETS = 3        # actor gets item arg
+    LOADS = 4       # arg: live shells, value: blank shells
+    SHOOTS = 5      # actor shoots player arg, value: shell is live
+    USES = 6        # actor uses item arg, value: what they saw (see Event.shell)
+    WINS_PHASE = 7  # actor wins phase arg
+    WINS_GAME = 8   # actor wins the game
+
+
+class Event(NamedTuple):
+    '''
+    one action in a game, the same size whatever it is
+
+    actors and targets are indexes into PLAYER_NAMES. for glass and beer,
+    value is whether the shell was live; for the phone, it's 2 *
+    shells_from_now + is_live. it's UNKNOWN when nobody says what they saw.
+    for the jammer, it's who it was used on.
+    '''
+    op: Op
+    actor: int = 0
+    arg: int = 0
+    value: int = 0
+    line: int = 0
+
+    def shell(self):
+        '''(shells_from_now, is_live) an item use saw, or None'''
+        if self.value == UNKNOWN:
+            return None
+        if self.arg == Items.BURNER_PHONE:
+            return self.value >> 1, bool(self.value & 1)
+        return 0, bool(self.value)
+
+
+class RoundIndex(NamedTuple):
+    '''where a round starts in a replay, and enough of the state there to start replaying from it'''
+    record: int
+    line: int
+    phase_num: int
+    round_num: int
+    max_charges: int
+    critical_charges: int
+    is_double_or_nothing_mode: bool
+    dealer_won_phases: int
+    critical: int
+    charges: tuple
+    items: tuple
+
+    def pack(self):
+        return ROUND_INDEX.pack(
+            self.record,
+            self.line,
+            self.phase_num,
+            self.round_num,
+            self.max_charges,
+            self.critical_charges,
+            self.is_double_or_nothing_mode,
+            self.dealer_won_phases,
+            self.critical,
+            *self.charges,
+            *(bytes(items).ljust(8, bytes([NO_ITEM])) for items in self.items),
+        )
+
+    @classmethod
+    def unpack_from(cls, buffer, offset):
+        fields = ROUND_INDEX.unpack_from(buffer, offset)
+        items = tuple(tuple(Items(item) for item in packed_items if item != NO_ITEM) for packed_items in fields[11:13])
+        return cls(*fields[:6], bool(fields[6]), *fields[7:9], fields[9:11], items)
+
+    @classmethod
+    def from_state(cls, state, record, line):
+        '''the index of a round about to be loaded in state'''
+        players = [state.phase.players[name] for name in PLAYER_NAMES]
+        return cls(
+            record=record,
+            line=line,
+            phase_num=state.num_completed_phases,
+            round_num=state.phase.num_completed_rounds,
+            max_charges=state.phase.max_charges,
+            critical_charges=state.phase.critical_charges,
+            is_double_or_nothing_mode=state.is_double_or_nothing_mode,
+            dealer_won_phases=sum(1 << i for i, winner_name in enumerate(state.winner_names_by_phase) if winner_name == "dealer"),
+            critical=sum(1 << i for i, player in enumerate(players) if player.is_critical),
+            charges=tuple(player.charges for player in players),
+            items=tuple(tuple(player.items) for player in players),
+        )
+
+    def to_state(self):
+        return GameState(
+            player_names=list(PLAYER_NAMES),
+            is_double_or_nothing_mode=self.is_double_or_nothing_mode,
+            phase=PhaseState(
+                players=OrderedDict(
+                    (name, Player(charges=self.charges[i], items=list(self.items[i]), is_critical=bool(self.critical >> i & 1)))
+                    for i, name in enumerate(PLAYER_NAMES)
+                ),
+                max_charges=self.max_charges,
+                critical_charges=self.critical_charges,
+                num_completed_rounds=self.round_num,
+            ),
+            num_completed_phases=self.phase_num,
+            winner_names_by_phase=[PLAYER_NAMES[self.dealer_won_phases >> i & 1] for i in range(self.phase_num)],
+        )
+
+
+def apply_event(state, event):
+    '''
+    change state (in place) the way the log line event came from would
+
+    events are assumed to be valid, as they are when they come from a
+    replay: nothing is checked that the game itself doesn't check
+    '''
+    match event.op:
+        case Op.PILLS:
+            state.is_double_or_nothing_mode = True
+        case Op.PHASE:
+            state.phase = PhaseState(
+                players=OrderedDict((name, Player(charges=event.arg)) for name in state.player_names),
+                max_charges=event.arg,
+                critical_charges=event.value,
+            )
+        case Op.GETS:
+            state.phase.players[PLAYER_NAMES[event.actor]].items.append(Items(event.arg))
+        case Op.LOADS:
+            state.phase.round = RoundState(total_live_shells=event.arg, total_blank_shells=event.value)
+        case Op.SHOOTS:
+            state.shoot(PLAYER_NAMES[event.arg], bool(event.value))
+        case Op.USES:
+            actor_name = PLAYER_NAMES[event.actor]
+            item = Items(event.arg)
+            state.phase.players[actor_name].items.remove(item)
+            if item == Items.JAMMER:
+                state.phase.use_item(actor_name, item, target_name=PLAYER_NAMES[event.value])
+                return
+            shells_from_now, is_live = event.shell() or (0, None)
+            state.phase.use_item(actor_name, item, is_live, shells_from_now)
+
+
+def _roman(num):
+    return "I" * (num + 1)
+
+def _shell_name(is_live):
+    return "live" if is_live else "blank"
+
+
+def to_lines(events):
+    '''the .buckshot log lines for events, with items dealt together on one line'''
+    lines = []
+    gets = {}
+    for event in events:
+        if event.op == Op.GETS:
+            gets.setdefault(event.actor, []).append(ITEM_NAMES[event.arg])
+            continue
+        if gets:
+            lines.append("; ".join(f"{PLAYER_NAMES[actor]} gets {", ".join(item_names)}" for actor, item_names in gets.items()))
+            gets = {}
+        lines.append(to_line(event))
+    return lines
+
+
+def number_lines(events, first_line=1):
+    '''events with the line numbers they'd have in to_lines(events)'''
+    numbered_events = []
+    line = first_line - 1
+    previous_op = None
+    for event in events:
+        if not (event.op == Op.GETS and previous_op == Op.GETS):
+            line += 1
+        previous_op = event.op
+        numbered_events.append(event._replace(line=line))
+    return numbered_events
+
+
+def to_line(event):
+    if event.op == Op.PHASE:
+        line = f"phase {_roman(event.actor)}, {event.arg} {"charge" if event.arg == 1 else "charges"}"
+        if event.value:
+            line += f", critical at {event.value}"
+        return line
+
+    actor_name = PLAYER_NAMES[event.actor]
+    match event.op:
+        case Op.PILLS:
+            return f"{actor_name} uses pills"
+        case Op.ROUND:
+            return f"round {_roman(event.arg)}.{event.value + 1}"
+        case Op.GETS:
+            return f"{actor_name} gets {ITEM_NAMES[event.arg]}"
+        case Op.LOADS:
+            return f"dealer loads {event.arg} live, {event.value} blank"
+        case Op.SHOOTS:
+            target_name = "self" if event.arg == event.actor else PLAYER_NAMES[event.arg]
+            return f"{actor_name} shoots {target_name}, {_shell_name(event.value)}"
+        case Op.USES:
+            line = f"{actor_name} uses {ITEM_NAMES[event.arg]}"
+            if event.arg == Items.JAMMER:
+                return f"{line} on {PLAYER_NAMES[event.value]}"
+            shell = event.shell()
+            if shell is None:
+                return line
+            shells_from_now, is_live = shell
+            match event.arg:
+                case Items.MAGNIFYING_GLASS:
+                    return f"{line}, sees {_shell_name(is_live)}"
+                case Items.BEER:
+                    return f"{line}, ejects {_shell_name(is_live)}"
+                case Items.BURNER_PHONE:
+                    return f"{line}, hears {CARDINALS[shells_from_now]} {_shell_name(is_live)}"
+            return line
+        case Op.WINS_PHASE:
+            return f"{actor_name} wins phase {_roman(event.arg)}"
+        case Op.WINS_GAME:
+            return f"{actor_name} wins game"
+
+
+def from_text(lines):
+    '''
+    the events of a .buckshot log, validating it on the way (so this raises
+    whatever parse_line raises)
+
+    comments, !check lines and odds queries have no events, so converting
+    back to text leaves them out. odds queries aren't even run.
+    '''
+    events = []
+    state = GameState(player_names=list(PLAYER_NAMES))
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#") or (line.startswith("!check") and line.endswith("odds")):
+            continue
+        state = parse_line(state, line)
+        for part in line.split(";"):
+            part = part.strip()
+            if part and not part.startswith("#"):
+                events.extend(line_events(tokenize(part), line_num))
+    return events
+
+
+def line_events(words, line):
+    '''the events of a log line that's been tokenized and validated (see from_text), which is line number line'''
+    match words:
+        case ["player", "uses", "pills"]:
+            return [Event(Op.PILLS, 0, line=line)]
+        case ["phase", phase_name, ",", max_charges, _, *more]:
+            critical_charges = int(more[-1]) if more else 0
+            return [Event(Op.PHASE, len(phase_name) - 1, int(max_charges), critical_charges, line)]
+        case ["round", phase_name, ".", round_num]:
+            return [Event(Op.ROUND, 0, len(phase_name) - 1, int(round_num) - 1, line)]
+        case [player_name, "gets", *separated_item_names]:
+            actor = PLAYER_NAMES.index(player_name)
+            return [Event(Op.GETS, actor, items_by_name[item_name], 0, line) for item_name in separated_item_names[::2]]
+        case ["dealer", "loads", live_shells, "live", ",", blank_shells, "blank"]:
+            return [Event(Op.LOADS, 0, int(live_shells), int(blank_shells), line)]
+        case [player_name, "shoots", target_name, ",", shell_type]:
+            actor = PLAYER_NAMES.index(player_name)
+            target = actor if target_name == "self" else PLAYER_NAMES.index(target_name)
+            return [Event(Op.SHOOTS, actor, target, int(shell_type == "live"), line)]
+        case ["players", *_]:
+            raise ValueError("replays only have room for the player and the dealer")
+        case [player_name, "uses", "jammer", "on", target_name]:
+            return [Event(Op.USES, PLAYER_NAMES.index(player_name), Items.JAMMER, PLAYER_NAMES.index(target_name), line)]
+        case [player_name, "uses", item_name, *more]:
+            match more:
+                case [",", "hears", cardinal, shell_type]:
+                    value = 2 * cardinal_to_ordinal[cardinal] + (shell_type == "live")
+                case [",", _, shell_type]:
+                    value = int(shell_type == "live")
+                case _:
+                    value = UNKNOWN
+            return [Event(Op.USES, PLAYER_NAMES.index(player_name), items_by_name[item_name], value, line)]
+        case [player_name, "wins", "phase", phase_name]:
+            return [Event(Op.WINS_PHASE, PLAYER_NAMES.index(player_name), len(phase_name) - 1, 0, line)]
+        case [player_name, "wins", "game"]:
+            return [Event(Op.WINS_GAME, PLAYER_NAMES.index(player_name), 0, 0, line)]
+    return []
+
+
+def index_rounds(events):
+    '''a RoundIndex for every round in events'''
+    rounds = []
+    state = GameState(player_names=list(PLAYER_NAMES))
+    for i, event in enumerate(events):
+        if event.op == Op.LOADS:
+            rounds.append(RoundIndex.from_state(state, i, event.line))
+        apply_event(state, event)
+    return rounds
+
+
+def write_binary(f, events):
+    '''
+    write events to the binary file f: a header, an index of where each
+    round starts, then one fixed-width record per event
+    '''
+    rounds = index_rounds(events)
+    f.write(HEADER.pack(MAGIC, VERSION, len(events), len(rounds)))
+    f.write(b"".join(round.pack() for round in rounds))
+    f.write(b"".join(RECORD.pack(*event) for event in events))
+
+
+def read_binary(f):
+    '''every event in the binary file f'''
+    with Replay(f) as replay:
+        return replay.events()
+
+
+class Replay:
+    '''
+    a binary replay, memory-mapped so any position can be reached by
+    replaying from the start of its round instead of from the start of the
+    game
+    '''
+
+    def __init__(self, f):
+        self.data = mmap(f.fileno(), 0, access=ACCESS_READ)
+        magic, version, self.num_records, num_rounds = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{f.name} isn't a version {VERSION} replay")
+        self.rounds = [
+            RoundIndex.unpack_from(self.data, HEADER.size + i * ROUND_INDEX.size)
+            for i in range(num_rounds)
+        ]
+        self.round_records = [round.record for round in self.rounds]
+        self.records_offset = HEADER.size + num_rounds * ROUND_INDEX.size
+
+    def __len__(self):
+        return self.num_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def event(self, i):
+        op, actor, arg, value, line = RECORD.unpack_from(self.data, self.records_offset + i * RECORD.size)
+        return Event(Op(op), actor, arg, value, line)
+
+    def events(self, start=0, stop=None):
+        stop = self.num_records if stop is None else stop
+        return [self.event(i) for i in range(start, stop)]
+
+    def state_at(self, record):
+        '''the game state just before record'''
+        i = bisect_right(self.round_records, record) - 1
+        if i < 0:
+            state = GameState(player_names=list(PLAYER_NAMES))
+            start = 0
+        else:
+            state = self.rounds[i].to_state()
+            start = self.rounds[i].record
+        for event in self.events(start, record):
+            apply_event(state, event)
+        return state
+
+    def state_at_line(self, line):
+        '''the game state just before line of the text log'''
+        record = bisect_left(range(self.num_records), line, key=lambda i: self.event(i).line)
+        return self.state_at(record)
+
+    def state_at_round(self, phase_num, round_num):
+        '''the game state just before the shells are loaded for a round (numbered from 0)'''
+        for round in self.rounds:
+            if (round.phase_num, round.round_num) == (phase_num, round_num):
+                return round.to_state()
+        raise KeyError(f"no round {_roman(phase_num)}.{round_num + 1}")
+
+
+def check_round_trip(lines):
+    '''
+    what writing a (valid, two-player) log as a replay and reading it back
+    loses, as a list of messages: the events read back from the file have
+    to be the ones written, the state just before every line has to be the
+    one parsing the log reaches there, and the log written back as text has
+    to have the same events
+    '''
+    problems = []
+    events = from_text(lines)
+    with TemporaryFile() as f:
+        write_binary(f, events)
+        f.flush()
+        with Replay(f) as replay:
+            if replay.events() != events:
+                problems.append("the events read back aren't the ones written")
+            state = GameState(player_names=list(PLAYER_NAMES))
+            for line_num, line in enumerate(lines, 1):
+                replayed_state = replay.state_at_line(line_num)
+                if replayed_state != state:
+                    problems.append(f"line {line_num}: replayed {replayed_state}, parsed {state}")
+                    break
+                line = line.strip()
+                if not (line.startswith("!check") and line.endswith("odds")):
+                    state = parse_line(state, line)
+
+    written_events = from_text(to_lines(events))
+    if [event._replace(line=0) for event in written_events] != [event._replace(line=0) for event in events]:
+        problems.append("the log written back as text has different events")
+    return problems
+
+
+def parse_args():
+    parser = ArgumentParser(description="convert logs to and from binary replays, and look inside replays")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    to_binary_parser = commands.add_parser("to-binary", help="validate a .buckshot log and write it as a replay")
+    to_binary_parser.add_argument("LOGFILE")
+    to_binary_parser.add_argument("REPLAY")
+
+    to_text_parser = commands.add_parser("to-text", help="write a replay as a .buckshot log")
+    to_text_parser.add_argument("REPLAY")
+    to_text_parser.add_argument("LOGFILE")
+
+    check_parser = commands.add_parser("check", help="check that logs survive being written as replays and read back")
+    check_parser.add_argument("LOGFILE", nargs="+")
+
+    show_parser = commands.add_parser("show", help="print the game state at some point in a replay")
+    show_parser.add_argument("REPLAY")
+    position = show_parser.add_mutually_exclusive_group(required=True)
+    position.add_argument("--round", help="just before the shells are loaded in this round, like II.3")
+    position.add_argument("--line", type=int, help="just before this line of the text log")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    match args.command:
+
+        case "to-binary":
+            with open(args.LOGFILE) as f:
+                try:
+                    events = from_text(f)
+                except (LogParseError, GameError, ValueError) as e:
+                    exit(f"{args.LOGFILE} failed: {e}")
+            with open(args.REPLAY, "wb") as f:
+                write_binary(f, events)
+
+        case "to-text":
+            with open(args.REPLAY, "rb") as f:
+                lines = to_lines(read_binary(f))
+            with open(args.LOGFILE, "w") as f:
+                f.write("\n".join(lines) + "\n")
+
+        case "check":
+            num_failed = 0
+            for path in args.LOGFILE:
+                with open(path) as f:
+                    lines = f.readlines()
+                try:
+                    problems = check_round_trip(lines)
+                except ValueError as e:
+                    print(f"{path} skipped: {e}", file=stderr)
+                    continue
+                for problem in problems:
+                    print(f"{path}: {problem}", file=stderr)
+                num_failed += bool(problems)
+            print(f"{len(args.LOGFILE)} logs, {num_failed} changed by a round trip", file=stderr)
+            exit(1 if num_failed else 0)
+
+        case "show":
+            with open(args.REPLAY, "rb") as f, Replay(f) as replay:
+                if args.round is not None:
+                    phase_name, round_num = args.round.split(".")
+                    state = replay.state_at_round(len(phase_name) - 1, int(round_num) - 1)
+                else:
+                    state = replay.state_at_line(args.line)
+            print(state)
@@ -0,0 +1,174 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from math import sqrt
+from random import Random
+from time import monotonic
+from typing import NamedTuple
+
+from moves import legal_moves, order_moves, outcomes
+from packed_state import PackedPhase
+
+# z score of the confidence intervals (95%)
+CONFIDENCE_Z = 1.96
+
+# samples when there's no budget at all
+DEFAULT_MAX_SAMPLES = 10_000
+
+
+def random_policy(state, rng):
+    '''any move that could help, all equally likely'''
+    return rng.choice(legal_moves(state))
+
+def greedy_policy(state, rng):
+    '''the move the solver would try first'''
+    return order_moves(state, legal_moves(state))[0]
+
+POLICIES = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+}
+
+
+class Estimate(NamedTuple):
+    value: float
+    low: float
+    high: float
+    samples: int
+
+    def __str__(self):
+        return f"{self.value:.3f} ({self.low:.3f}-{self.high:.3f}, {self.samples} rollouts)"
+
+
+def wilson_interval(wins, samples, z=CONFIDENCE_Z):
+    '''confidence interval for a win rate, which stays inside [0, 1] even with few samples'''
+    if samples == 0:
+        return 0.0, 1.0
+    p = wins / samples
+    denominator = 1 + z * z / samples
+    centre = (p + z * z / (2 * samples)) / denominator
+    half_width = z * sqrt(p * (1 - p) / samples + z * z / (4 * samples * samples)) / denominator
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+def _result(state, player):
+    '''1 if player has won, 0 if they've lost or the round is over, None if it isn't (like Solver._terminal_value)'''
+    if state.charges[player] <= 0:
+        return 0
+    if sum(charges > 0 for charges in state.charges) == 1:
+        return 1
+    if state.round is None:
+        return 0
+    return None
+
+
+def rollout(state, player, policy, rng):
+    '''play state out to the end of the round once, with both sides following policy'''
+    while (result := _result(state, player)) is None:
+        move = policy(state, rng)
+        results = outcomes(state, move)
+        _, state = rng.choices(results, weights=[chance for chance, _ in results])[0]
+    return result
+
+
+def run_rollouts(state, player, policy_name, num_samples, seed, deadline=None):
+    '''(wins, samples) from up to num_samples rollouts, stopping early at deadline (a monotonic time)'''
+    policy = POLICIES[policy_name]
+    rng = Random(seed)
+    wins = 0
+    for samples in range(num_samples):
+        if deadline is not None and monotonic() >= deadline:
+            return wins, samples
+        wins += rollout(state, player, policy, rng)
+    return wins, num_samples
+
+
+class RolloutEvaluator:
+    '''
+    estimate win probability by playing positions out at random
+
+    much faster than solving positions with lots of shells and items, but
+    the estimate is the win rate when both sides follow policy, not when
+    they play perfectly, so it's only as good as the policy. sampling stops
+    after max_samples rollouts or time_budget seconds, whichever comes
+    first; estimates yields the estimate so far after every batch, so it can
+    be read at any time. with more than one worker, batches run in a process
+    pool.
+    '''
+
+    def __init__(self, policy="random", max_samples=None, time_budget=None, workers=1, batch_size=100, seed=None):
+        if policy not in POLICIES:
+            raise ValueError(f"no such rollout policy {policy}")
+        if max_samples is None and time_budget is None:
+            max_samples = DEFAULT_MAX_SAMPLES
+        self.policy = policy
+        self.max_samples = max_samples
+        self.time_budget = time_budget
+        self.workers = workers
+        self.batch_size = batch_size
+        self.rng = Random(seed)
+
+    def win_probability(self, phase, player_name):
+        '''Estimate of the chance that player_name wins the phase before this round runs out of shells'''
+        estimate = None
+        for estimate in self.estimates(phase, player_name):
+            pass
+        return estimate
+
+    def estimates(self, phase, player_name):
+        state = phase if isinstance(phase, PackedPhase) else PackedPhase.from_phase(phase)
+        player = state.player_names.index(player_name)
+        deadline = None if self.time_budget is None else monotonic() + self.time_budget
+        if self.workers > 1:
+            yield from self._parallel_estimates(state, player, deadline)
+            return
+
+        wins = samples = 0
+        while self._should_continue(samples, deadline):
+            batch_size = self._next_batch_size(samples)
+            batch_wins, batch_samples = run_rollouts(state, player, self.policy, batch_size, self.rng.getrandbits(64), deadline)
+            wins += batch_wins
+            samples += batch_samples
+            yield self._estimate(wins, samples)
+        if samples == 0:
+            yield self._estimate(wins, samples)
+
+    def _parallel_estimates(self, state, player, deadline):
+        wins = samples = 0
+        submitted = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            running = set()
+
+            def submit():
+                nonlocal submitted
+                batch_size = self._next_batch_size(submitted)
+                running.add(pool.submit(run_rollouts, state, player, self.policy, batch_size, self.rng.getrandbits(64), deadline))
+                submitted += batch_size
+
+            # keep every worker busy, with one batch queued behind it
+            while len(running) < 2 * self.workers and self._should_continue(submitted, deadline):
+                submit()
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_wins, batch_samples = future.result()
+                    wins += batch_wins
+                    samples += batch_samples
+                    if self._should_continue(submitted, deadline):
+                        submit()
+                yield self._estimate(wins, samples)
+        if samples == 0:
+            yield self._estimate(wins, samples)
+
+    def _should_continue(self, samples, deadline):
+        if self.max_samples is not None and samples >= self.max_samples:
+            return False
+        return deadline is None or monotonic() < deadline
+
+    def _next_batch_size(self, samples):
+        if self.max_samples is None:
+            return self.batch_size
+        return min(self.batch_size, self.max_samples - samples)
+
+    def _estimate(self, wins, samples):
+        low, high = wilson_interval(wins, samples)
+        value = wins / samples if samples else 0.5
+        return Estimate(value, low, high, samples)
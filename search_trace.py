@@ -0,0 +1,97 @@
+import heapq
+import json
+from collections import Counter
+from time import perf_counter
+
+
+class SearchTrace:
+    '''
+    what the solver did, for finding out where a search spends its time
+
+    the solver only calls into this when it has one (Solver.trace), so a
+    solver without a trace pays nothing for it. counts are kept per odds
+    query: record_query writes them out (to json_path as a JSON line, if
+    given) and starts over. folded stacks add up across queries and are
+    written to folded_path by close, for flamegraph.pl and compatible tools.
+    '''
+
+    def __init__(self, json_path=None, folded_path=None, num_hottest=10):
+        self.json_path = json_path
+        self.folded_path = folded_path
+        self.num_hottest = num_hottest
+        self.folded_stacks = Counter()
+        self.reset()
+
+    def reset(self):
+        self.nodes_expanded = 0
+        self.terminal_hits = 0
+        self.cache_hits = 0
+        self.store_hits = 0
+        self.tablebase_hits = 0
+        self.nodes_by_depth = Counter()
+        self.moves_by_depth = Counter()
+        self.seconds_by_depth = Counter()
+        self.path = []
+        self.hottest_subtrees = []
+
+    def enter(self):
+        '''a node is about to be expanded'''
+        self.nodes_expanded += 1
+        return perf_counter(), self.nodes_expanded
+
+    def leave(self, depth, num_moves, started):
+        '''the node entered at started is done, after generating num_moves moves'''
+        start_time, start_nodes = started
+        self.nodes_by_depth[depth] += 1
+        self.moves_by_depth[depth] += num_moves
+        self.seconds_by_depth[depth] += perf_counter() - start_time
+
+        stack = ";".join(["root", *self.path])
+        self.folded_stacks[stack] += 1
+
+        subtree = (self.nodes_expanded - start_nodes + 1, stack)
+        if len(self.hottest_subtrees) < self.num_hottest:
+            heapq.heappush(self.hottest_subtrees, subtree)
+        else:
+            heapq.heappushpop(self.hottest_subtrees, subtree)
+
+    def to_dict(self):
+        return {
+            "nodes_expanded": self.nodes_expanded,
+            "terminal_hits": self.terminal_hits,
+            "cache_hits": self.cache_hits,
+            "store_hits": self.store_hits,
+            "tablebase_hits": self.tablebase_hits,
+            "by_depth": [
+                {
+                    "depth": depth,
+                    "nodes": self.nodes_by_depth[depth],
+                    "branching_factor": self.moves_by_depth[depth] / self.nodes_by_depth[depth],
+                    "seconds_inclusive": self.seconds_by_depth[depth],
+                }
+                for depth in sorted(self.nodes_by_depth)
+            ],
+            "hottest_subtrees": [
+                {"path": stack, "nodes": nodes}
+                for nodes, stack in sorted(self.hottest_subtrees, reverse=True)
+            ],
+        }
+
+    def record_query(self, player_name, value, principal_variation):
+        record = {
+            "player": player_name,
+            "value": value,
+            **self.to_dict(),
+            "principal_variation": principal_variation,
+        }
+        if self.json_path is not None:
+            with open(self.json_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        self.reset()
+        return record
+
+    def close(self):
+        if self.folded_path is not None:
+            with open(self.folded_path, "w") as f:
+                for stack, count in sorted(self.folded_stacks.items()):
+                    f.write(f"{stack} {count}\n")
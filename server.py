@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from sys import exit, stderr, stdin
+from time import perf_counter
+
+from exceptions import GameError
+from game_state import GameState
+from packed_state import PackedPhase
+from parse_log import LogParseError, parse_line
+from solver import default_solver
+
+# requests bigger than this are refused, so one client can't run the server out of memory
+MAX_REQUEST_BYTES = 1 << 20
+
+
+class RequestError(Exception):
+    '''a request that can't be answered, for the error field of the response'''
+    pass
+
+
+class Session:
+    '''one game being played: the state after every line appended so far'''
+
+    def __init__(self):
+        self.state = GameState(player_names=["player", "dealer"])
+        self.num_lines = 0
+
+    def append(self, line):
+        '''
+        apply a log line, or raise whatever parse_line raises and leave the
+        state (and the line count) as it was
+
+        odds queries are skipped, even in lines conjoined by a semicolon, since
+        they're asked with odds requests (and parse_line would solve them on
+        the event loop)
+        '''
+        parts = [part for part in line.split(";") if not _is_odds_query(part)]
+        self.state = parse_line(self.state, ";".join(parts))
+        self.num_lines += 1
+
+
+def _is_odds_query(line):
+    words = line.split()
+    return words[:1] == ["!check"] and words[-1:] == ["odds"]
+
+
+class AnalysisServer:
+    '''
+    keeps games and the solver's cache in memory between queries, so overlays
+    and bots don't pay for starting python, importing, replaying the log and
+    solving from a cold cache every time
+
+    clients send one JSON object per line and get one back per line, in
+    order. every request names a session (any string; it's created by its
+    first line):
+
+        {"op": "append", "session": "s", "lines": ["dealer loads 2 live, 1 blank"]}
+            -> {"ok": true, "lines": 7}, or {"ok": false, "error": ..., "line": 7}
+            if a line doesn't validate (the lines before it are kept)
+        {"op": "odds", "session": "s", "player": "player", "time_budget": 0.5}
+            -> {"ok": true, "odds": 0.75, "search": ..., "seconds": ...}
+        {"op": "state", "session": "s"}
+            -> charges, items and shells left
+        {"op": "close", "session": "s"}
+        {"op": "stats"}
+
+    a request that can't be answered gets {"ok": false, "error": ...} back;
+    one longer than MAX_REQUEST_BYTES also ends the connection.
+
+    odds are solved one at a time by one worker thread, since the solver isn't
+    thread-safe, so appends and state requests for other sessions are answered
+    while a slow position is being solved. with a time budget (per request,
+    or time_budget for all of them), odds are the best estimate found in that
+    time (see Solver.deepening_value) instead of blocking until solved.
+    '''
+
+    def __init__(self, solver=default_solver, time_budget=None, cache_path=None):
+        self.solver = solver
+        self.time_budget = time_budget
+        self.sessions = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.num_requests = 0
+        self.num_queries = 0
+        if cache_path is not None:
+            # sqlite connections can only be used by the thread that opened them
+            self.executor.submit(self._open_store, cache_path).result()
+
+    def _open_store(self, cache_path):
+        from position_store import PositionStore
+        self.solver.store = PositionStore(cache_path)
+
+    def close(self):
+        if self.solver.store is not None:
+            self.executor.submit(self.solver.store.close).result()
+            self.solver.store = None
+        self.executor.shutdown()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the rest of the request is still to come, so there's no
+                    # telling where the next one starts
+                    response = {"ok": False, "error": f"requests can't be longer than {MAX_REQUEST_BYTES} bytes"}
+                    writer.write(json.dumps(response).encode() + b"\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                writer.write(json.dumps(await self.respond(line)).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.IncompleteReadError) as e:
+            print("client dropped:", e, file=stderr)
+        finally:
+            writer.close()
+
+    async def respond(self, line):
+        '''the response to a line of JSON; a request that fails gets an error response'''
+        try:
+            return await self.handle(json.loads(line))
+        except (RequestError, ValueError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            # a bug shouldn't cost the client its connection
+            traceback.print_exc()
+            return {"ok": False, "error": f"internal error: {type(e).__name__}: {e}"}
+
+    async def handle(self, request):
+        self.num_requests += 1
+        if not isinstance(request, dict):
+            raise RequestError("expected a JSON object")
+        match request.get("op"):
+            case "append":
+                return self.append(self._session(request, create=True), request.get("lines", []))
+            case "odds":
+                return await self.odds(self._session(request), request.get("player", "player"), request.get("time_budget", self.time_budget))
+            case "state":
+                return self.describe(self._session(request))
+            case "close":
+                self.sessions.pop(request.get("session"), None)
+                return {"ok": True}
+            case "stats":
+                return {
+                    "ok": True,
+                    "sessions": len(self.sessions),
+                    "requests": self.num_requests,
+                    "odds_queries": self.num_queries,
+                    "solver_cache": str(self.solver.table),
+                }
+            case op:
+                raise RequestError(f"no such op {op}")
+
+    def _session(self, request, create=False):
+        name = request.get("session")
+        if not isinstance(name, str):
+            raise RequestError("session must be a string")
+        if name not in self.sessions:
+            if not create:
+                raise RequestError(f"no such session {name}")
+            self.sessions[name] = Session()
+        return self.sessions[name]
+
+    def append(self, session, lines):
+        if isinstance(lines, str):
+            lines = [lines]
+        if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+            raise RequestError("lines must be a list of strings")
+        for line in lines:
+            try:
+                session.append(line)
+            except (LogParseError, GameError, KeyError, IndexError, ValueError) as e:
+                return {"ok": False, "error": str(e) or type(e).__name__, "line": session.num_lines + 1}
+        return {"ok": True, "lines": session.num_lines}
+
+    async def odds(self, session, player_name, time_budget=None):
+        if time_budget is not None and (not isinstance(time_budget, (int, float)) or time_budget <= 0):
+            raise RequestError("time_budget must be a positive number of seconds")
+        phase = session.state.phase
+        if phase is None or phase.round is None:
+            raise RequestError("no round is in progress")
+        if player_name not in phase.players:
+            raise RequestError(f"no such player {player_name}")
+        self.num_queries += 1
+
+        # the state is packed now, since later appends replace the session's state
+        state = PackedPhase.from_phase(phase)
+        start = perf_counter()
+        odds, search = await asyncio.get_running_loop().run_in_executor(self.executor, self._solve, state, player_name, time_budget)
+        return {"ok": True, "odds": odds, "search": search, "seconds": perf_counter() - start}
+
+    def _solve(self, state, player_name, time_budget):
+        if time_budget is None:
+            return self.solver.win_probability(state, player_name), "exact"
+        odds = self.solver.win_probability(state, player_name, time_budget=time_budget)
+        return odds, str(self.solver.last_deepening)
+
+    def describe(self, session):
+        state = session.state
+        response = {"ok": True, "lines": session.num_lines, "winner": state.winner, "phase": None}
+        if state.phase is not None:
+            round = state.phase.round
+            response["phase"] = {
+                "players": {
+                    name: {"charges": player.charges, "items": sorted(item.name.lower() for item in player.items)}
+                    for name, player in state.phase.players.items()
+                },
+                "turn": None if round is None else state.phase.current_player_name(),
+                "live_shells": None if round is None else round.remaining_live_shells(),
+                "blank_shells": None if round is None else round.remaining_blank_shells(),
+            }
+        return response
+
+    async def serve(self, socket_path=None, port=None):
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, socket_path, limit=MAX_REQUEST_BYTES)
+            print("listening on", socket_path, file=stderr)
+        else:
+            server = await asyncio.start_server(self.handle_client, "127.0.0.1", port, limit=MAX_REQUEST_BYTES)
+            print("listening on 127.0.0.1 port", port, file=stderr)
+        async with server:
+            await server.serve_forever()
+
+
+async def send(requests, socket_path=None, port=None):
+    '''send requests (JSON lines) to a server, yielding its responses'''
+    if socket_path is not None:
+        reader, writer = await asyncio.open_unix_connection(socket_path, limit=MAX_REQUEST_BYTES)
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=MAX_REQUEST_BYTES)
+    try:
+        for request in requests:
+            request = request.strip()
+            if not request:
+                continue
+            writer.write(request.encode() + b"\n")
+            await writer.drain()
+            yield (await reader.readline()).decode().rstrip("\n")
+    finally:
+        writer.close()
+
+
+def parse_args():
+    parser = ArgumentParser(description="keep games and the solver's cache in memory, and answer odds queries about them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--time-budget", type=float, metavar="SECONDS", help="default for odds requests that don't give one (they're exact otherwise)")
+    serve_parser.add_argument("--cache", help="sqlite file to save solved positions in and reuse them from (see position_store.py)")
+    serve_parser.add_argument("--tablebase", help="endgame tablebase to look positions up in (see tablebase.py)")
+
+    send_parser = subparsers.add_parser("send", help="send requests, one JSON object per line of stdin, and print the responses")
+
+    for subparser in (serve_parser, send_parser):
+        address = subparser.add_mutually_exclusive_group(required=True)
+        address.add_argument("--socket", metavar="PATH", help="unix socket")
+        address.add_argument("--port", type=int, help="port on localhost")
+    return parser.parse_args()
+
+
+async def _send_stdin(socket_path, port):
+    async for response in send(stdin, socket_path, port):
+        print(response, flush=True)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "send":
+        try:
+            asyncio.run(_send_stdin(args.socket, args.port))
+        except OSError as e:
+            exit(f"couldn't connect: {e}")
+        exit()
+
+    if args.tablebase is not None:
+        from tablebase import Tablebase
+        default_solver.tablebase = Tablebase.load(args.tablebase)
+    server = AnalysisServer(time_budget=args.time_budget, cache_path=args.cache)
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import os
+from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from random import Random, randrange
+from sys import stderr
+from time import perf_counter
+
+from game_state import GameState, PhaseState, Player, RoundState
+from items import Items
+from moves import Move
+from parse_log import double_or_nothing_items, story_mode_items
+from replay import ITEM_NAMES, PLAYER_NAMES, UNKNOWN, Event, Op, number_lines, to_lines, write_binary
+
+# max charges, critical charges, and items dealt to each player every round, for each phase
+PHASES = {
+    "story": [(2, 0, 0), (4, 0, 2), (6, 2, 4)],
+    "double_or_nothing": [(2, 0, 2), (4, 0, 3), (6, 2, 4)],
+}
+
+# only items the log format has names for are dealt
+ITEM_POOLS = {
+    "story": sorted(story_mode_items & ITEM_NAMES.keys()),
+    "double_or_nothing": sorted(double_or_nothing_items & ITEM_NAMES.keys()),
+}
+
+SHOTS = tuple(Move(target=target) for target in range(len(PLAYER_NAMES)))
+ITEM_USES = {item: Move(item=item) for item in Items}
+
+
+def possible_moves(state):
+    '''every move the player whose turn it is could make that can be written to a log'''
+    round = state.phase.round
+    user = 0 if round.is_players_turn else 1
+    other_player_name = PLAYER_NAMES[1 - user]
+    moves = list(SHOTS)
+    for item in sorted(set(state.phase.players[PLAYER_NAMES[user]].items)):
+        match item:
+            case Items.HAND_SAW if round.gun_is_sawed:
+                continue
+            case Items.HANDCUFFS if other_player_name in round.handcuffed_player_names:
+                continue
+            # the player has to say what they heard, and there's nothing to hear about the last shell
+            case Items.BURNER_PHONE if user == 0 and len(round.past_shells) + 1 >= round.total_shells():
+                continue
+        moves.append(ITEM_USES[item])
+    return moves
+
+
+def random_policy(state, rng):
+    '''any move, all equally likely'''
+    return rng.choice(possible_moves(state))
+
+def solver_policy(state, rng):
+    '''
+    the move the solver thinks is best for whoever's turn it is, knowing what
+    the player knows (slow for rounds with lots of shells and items)
+    '''
+    from solver import default_solver
+    mover_name = "player" if state.phase.round.is_players_turn else "dealer"
+    move = default_solver.best_move(state.phase, mover_name)
+    return random_policy(state, rng) if move is None else move
+
+POLICIES = {
+    "random": random_policy,
+    "solver": solver_policy,
+}
+
+
+def simulate_game(rng, mode="story", policy=random_policy):
+    '''play a whole game with both sides following policy, returning its events (see replay.py)'''
+    events = []
+    state = GameState(player_names=list(PLAYER_NAMES))
+    if mode == "double_or_nothing":
+        state.is_double_or_nothing_mode = True
+        events.append(Event(Op.PILLS))
+
+    while state.winner is None:
+        phase_num = state.num_completed_phases
+        max_charges, critical_charges, num_items = PHASES[mode][phase_num]
+        state.phase = PhaseState(
+            players=OrderedDict((name, Player(charges=max_charges)) for name in PLAYER_NAMES),
+            max_charges=max_charges,
+            critical_charges=critical_charges,
+        )
+        events.append(Event(Op.PHASE, phase_num, max_charges, critical_charges))
+        while state.phase is not None:
+            simulate_round(state, events, rng, ITEM_POOLS[mode], num_items, policy)
+        winner = PLAYER_NAMES.index(state.winner_names_by_phase[-1])
+        events.append(Event(Op.WINS_PHASE, winner, phase_num))
+
+    events.append(Event(Op.WINS_GAME, PLAYER_NAMES.index(state.winner)))
+    return events
+
+
+def simulate_round(state, events, rng, item_pool, num_items, policy):
+    phase = state.phase
+    events.append(Event(Op.ROUND, 0, state.num_completed_phases, phase.num_completed_rounds))
+
+    for actor, name in enumerate(PLAYER_NAMES):
+        items = phase.players[name].items
+        new_items = rng.choices(item_pool, k=min(num_items, state.max_items - len(items)))
+        items.extend(new_items)
+        events.extend(Event(Op.GETS, actor, item) for item in new_items)
+
+    num_shells = rng.randint(2, 8)
+    num_live_shells = rng.randint(1, num_shells - 1)
+    shells = [True] * num_live_shells + [False] * (num_shells - num_live_shells)
+    rng.shuffle(shells)
+    phase.round = RoundState(total_live_shells=num_live_shells, total_blank_shells=num_shells - num_live_shells)
+    events.append(Event(Op.LOADS, 0, num_live_shells, num_shells - num_live_shells))
+
+    while state.phase is not None and state.phase.round is not None:
+        round = state.phase.round
+        actor = 0 if round.is_players_turn else 1
+        actor_name = PLAYER_NAMES[actor]
+        shell_num = len(round.past_shells)
+        move = policy(state, rng)
+
+        if move.item is None:
+            is_live = shells[shell_num]
+            events.append(Event(Op.SHOOTS, actor, move.target, int(is_live)))
+            state.shoot(PLAYER_NAMES[move.target], is_live)
+            continue
+
+        # the log only says what the dealer saw when everyone sees it
+        is_live = None
+        shells_from_now = 0
+        value = UNKNOWN
+        if move.item == Items.BEER or (actor == 0 and move.item == Items.MAGNIFYING_GLASS):
+            is_live = shells[shell_num]
+            value = int(is_live)
+        elif actor == 0 and move.item == Items.BURNER_PHONE:
+            shells_from_now = rng.randint(1, num_shells - shell_num - 1)
+            is_live = shells[shell_num + shells_from_now]
+            value = 2 * shells_from_now + is_live
+
+        state.phase.players[actor_name].items.remove(move.item)
+        events.append(Event(Op.USES, actor, move.item, value))
+        state.phase.use_item(actor_name, move.item, is_live, shells_from_now)
+
+
+def write_games(outdir, first_game, num_games, mode="story", policy_name="random", seed=0, binary=False):
+    '''simulate games first_game, first_game + 1, ... and write each to its own file in outdir'''
+    policy = POLICIES[policy_name]
+    for i in range(first_game, first_game + num_games):
+        events = simulate_game(Random(seed + i), mode, policy)
+        path = os.path.join(outdir, f"game_{i:06d}")
+        if binary:
+            with open(path + ".replay", "wb") as f:
+                write_binary(f, number_lines(events))
+        else:
+            with open(path + ".buckshot", "w") as f:
+                f.write(f"# simulate.py --mode {mode} --policy {policy_name} --seed {seed + i}\n")
+                f.write("\n".join(to_lines(events)) + "\n")
+
+
+def parse_args():
+    parser = ArgumentParser(description="play games against itself and write them as logs")
+    parser.add_argument("OUTDIR")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--mode", choices=list(PHASES), default="story")
+    parser.add_argument("--policy", choices=list(POLICIES), default="random")
+    parser.add_argument("--seed", type=int, help="game i is played with seed + i, so any one can be played again with --games 1")
+    parser.add_argument("--binary", action="store_true", help="write replays (see replay.py) instead of .buckshot logs")
+    parser.add_argument("--workers", type=int, default=1, help="processes to simulate games in")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(args.OUTDIR, exist_ok=True)
+    seed = randrange(2 ** 32) if args.seed is None else args.seed
+    start = perf_counter()
+    if args.workers > 1:
+        chunk_size = -(-args.games // args.workers)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(write_games, args.OUTDIR, first_game, min(chunk_size, args.games - first_game), args.mode, args.policy, seed, args.binary)
+                for first_game in range(0, args.games, chunk_size)
+            ]
+            for future in futures:
+                future.result()
+    else:
+        write_games(args.OUTDIR, 0, args.games, args.mode, args.policy, seed, args.binary)
+    seconds = perf_counter() - start
+    print(f"{args.games} games in {seconds:.2f}s ({args.games / seconds:.0f} games/s)", file=stderr)
@@ -0,0 +1,515 @@
+from collections import OrderedDict
+from itertools import repeat
+from time import monotonic
+from typing import NamedTuple
+
+from items import Items
+from moves import legal_moves, order_moves, outcomes
+from packed_state import RULES_VERSION, PackedPhase, canonical_seats, position_key
+
+# roughly how many charges each item is worth, for heuristic_value
+ITEM_VALUES = {
+    Items.HANDCUFFS: 0.6,
+    Items.HAND_SAW: 0.5,
+    Items.CIGARETTES: 0.7,
+    Items.BEER: 0.3,
+    Items.MAGNIFYING_GLASS: 0.5,
+    Items.ADRENALINE: 0.4,
+    Items.INVERTER: 0.5,
+    Items.EXPIRED_MEDICINE: 0.3,
+    Items.BURNER_PHONE: 0.3,
+    Items.JAMMER: 0.5,
+    Items.REMOTE: 0.1,
+}
+
+# how much a surely live shell is worth to whoever holds the gun, for heuristic_value
+TURN_VALUE = 0.4
+
+# check the time budget every this many positions searched
+_DEADLINE_CHECK_INTERVAL = 256
+
+
+class TranspositionTable:
+    '''
+    bounded cache of solved positions; the least recently used entries are
+    evicted first, unless max_size is None
+
+    a search cut off by the bounds only learns that a position is worth at
+    least or at most some value, so each entry is (lower bound, upper bound,
+    best move). a fully solved position has equal bounds.
+    '''
+
+    def __init__(self, max_size=1_000_000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while self.max_size is not None and len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions, {len(self)}/{self.max_size} entries"
+
+
+def heuristic_value(state, player):
+    '''
+    a guess at the value of a position, for positions a search with a depth
+    limit doesn't look past
+
+    it's player's share of the charges of everyone still in (with items
+    counted as part of a charge), shifted towards whoever's turn it is by
+    how likely the shell is to be live, and scaled down when there aren't
+    enough live shells left to finish everyone else off this round (with
+    some to spare, since some will hit player). between rounds, it's just
+    the share.
+    '''
+    round = state.round
+    items = state.items or ((),) * len(state.charges)
+    strengths = [
+        charges + sum(ITEM_VALUES.get(item, 0.0) for item in player_items) if charges > 0 else 0.0
+        for charges, player_items in zip(state.charges, items)
+    ]
+    share = strengths[player] / sum(strengths)
+    if round is None:
+        return share
+    edge = (2 * round.chance_shell_is_live() - 1) * TURN_VALUE
+    share += edge if round.turn == player else -edge
+    others_charges = sum(charges for i, charges in enumerate(state.charges) if i != player and charges > 0)
+    reach = min(1.0, round.remaining_live_shells() / (others_charges + state.charges[player] / 2)) ** 2
+    return min(1.0, max(0.0, share)) * reach
+
+
+class Deepening(NamedTuple):
+    '''the result of Solver.deepening_value'''
+    value: float
+    depth: int      # moves searched before heuristic_value took over
+    is_exact: bool  # the search reached the end of the round everywhere
+
+    def __str__(self):
+        if self.is_exact:
+            return f"exact (solved in {self.depth} moves)" if self.depth else "exact (already solved)"
+        return f"estimate from {self.depth} moves deep"
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class Solver:
+    '''
+    expectimax search over the moves left in a round
+
+    the player whose turn it is picks the move that's best for them: the
+    player we're solving for maximizes their win probability and everyone
+    else minimizes it (with more than two players, as if they'd all teamed
+    up against them). moves are shots and item uses (see moves.py);
+    shells, phone calls and medicine are chance nodes. anything learned with
+    glass or phone is treated as known to both players.
+
+    the search runs on PackedPhase, so each move makes a new immutable state
+    instead of copying the old one. values are bounded by alpha and beta:
+    decision nodes stop once a move is good enough that the other side
+    won't allow it, and chance nodes stop once the outcomes so far pin the
+    expectation outside the bounds (star1). solved positions and their best
+    moves are kept in a transposition table, so positions reached by
+    different move orders are only searched once, and so are positions that
+    only differ in where everyone sits (see canonical_seats); best moves are
+    kept in the canonical seating and moved back when they're read. with a
+    store (see position_store.py), solved positions are also saved for later
+    runs. with a tablebase (see tablebase.py), endgame positions are looked
+    up instead of searched. with a trace (see search_trace.py), the search
+    records what it does; parallel workers don't.
+
+    a round that runs out of shells with more than one player still in is
+    lost, unless there's a round_end: a function of (state, player) giving
+    the value of such positions (say, the chance of winning the rest of the
+    phase; see game_value.py). saved positions and tablebases are solved
+    without one, so they can't be used with one.
+    '''
+
+    def __init__(self, table=None, prune=True, workers=1, split_depth=1, store=None, tablebase=None, trace=None, round_end=None):
+        if round_end is not None and (store is not None or tablebase is not None or workers > 1):
+            raise ValueError("a solver with a round_end can't use a store, a tablebase or workers")
+        self.table = TranspositionTable() if table is None else table
+        self.prune = prune
+        self.workers = workers
+        self.split_depth = split_depth
+        self.store = store
+        self.tablebase = tablebase
+        self.trace = trace
+        self.round_end = round_end
+        self.nodes_searched = 0
+
+        # set by deepening_value for each iteration
+        self.time_budget = None
+        self.max_depth = None
+        self.deadline = None
+        self.exact_table = None
+        self.hints = {}
+        self.estimates = set()  # keys of entries in the iteration's table that depend on a heuristic_value
+        self.leaves_cut_off = 0
+        self.last_deepening = None
+
+    def win_probability(self, phase, player_name, depth=1, workers=None, time_budget=None):
+        '''
+        chance that player_name wins the phase before this round runs out of
+        shells (or at all, with a round_end)
+
+        with a time budget (in seconds), it's the best estimate that could be
+        found in that time (see deepening_value). otherwise, with more than
+        one worker, the positions split_depth moves from now are solved in a
+        process pool (see parallel_value)
+        '''
+        state = phase if isinstance(phase, PackedPhase) else PackedPhase.from_phase(phase)
+        player = state.player_names.index(player_name)
+        workers = self.workers if workers is None else workers
+        time_budget = self.time_budget if time_budget is None else time_budget
+        if time_budget is not None:
+            self.last_deepening = self.deepening_value(state, player, time_budget)
+            value = self.last_deepening.value
+        elif workers > 1:
+            value = self.parallel_value(state, player, workers)
+        else:
+            value = self.value(state, player, depth=depth)
+        if self.store is not None:
+            self.store.flush()
+        if self.trace is not None:
+            self.trace.record_query(player_name, value, self.principal_variation(state, player))
+        return value
+
+    def deepening_value(self, state, player, time_budget, max_depth=None):
+        '''
+        search one move deeper at a time, until the search reaches the end of
+        the round or time_budget seconds run out, and return a Deepening
+
+        positions past the depth limit get heuristic_value instead of being
+        searched, so until a search gets through without cutting any off,
+        the value is only an estimate. each iteration tries the best moves
+        the one before it found first. if time runs out partway through an
+        iteration, the last one that finished is used (or heuristic_value, if
+        none did), so this never takes much longer than time_budget.
+
+        estimates are kept in a table of their own, keyed by how many moves
+        were left to search, and nothing is saved to the store. positions the
+        solver's own table already has exact values for aren't estimated, and
+        subtrees an iteration solves without cutting anything off are added
+        to it, so a warm table answers straight away.
+        '''
+        table, store = self.table, self.store
+        entry = table.get(position_key(state, player))
+        if entry is not None and entry[0] == entry[1]:
+            return Deepening(entry[0], 0, True)
+        deadline = monotonic() + time_budget
+        result = Deepening(heuristic_value(state, player), 0, False)
+        self.exact_table = table
+        self.store = None
+        self.deadline = deadline
+        self.hints = {}
+        depth = 1
+        try:
+            while max_depth is None or depth <= max_depth:
+                self.table = TranspositionTable(max_size=table.max_size)
+                self.estimates = set()
+                self.max_depth = depth
+                self.leaves_cut_off = 0
+                value = self.value(state, player)
+                result = Deepening(value, depth, self.leaves_cut_off == 0)
+                if result.is_exact:
+                    break
+                self.hints = {key: entry[2] for (key, _), entry in self.table.entries.items() if entry[2] is not None}
+                depth += 1
+        except _OutOfTime:
+            pass
+        finally:
+            self.table, self.store = table, store
+            self.exact_table = self.max_depth = self.deadline = None
+            self.hints = {}
+            self.estimates = set()
+        return result
+
+    def principal_variation(self, state, player, max_length=40):
+        '''
+        the line of play the search expects: each side's best move, following
+        the most likely outcome of each one
+        '''
+        line = []
+        while len(line) < max_length and self._terminal_value(state, player) is None:
+            entry = self.table.get(position_key(state, player))
+            if entry is None or entry[2] is None:
+                break
+            lower, upper, move = entry
+            move = _reseated(move, canonical_seats(state, player))
+            chance, next_state = max(outcomes(state, move), key=lambda outcome: outcome[0])
+            line.append({
+                "mover": state.player_names[state.round.turn],
+                "move": move.describe(state),
+                "value": lower if lower == upper else [lower, upper],
+                "chance": chance,
+            })
+            state = next_state
+        return line
+
+    def best_move(self, phase, player_name):
+        '''the move the search settled on for the player whose turn it is, if any'''
+        state = phase if isinstance(phase, PackedPhase) else PackedPhase.from_phase(phase)
+        player = state.player_names.index(player_name)
+        self.value(state, player)
+        entry = self.table.get(position_key(state, player))
+        return None if entry is None else _reseated(entry[2], canonical_seats(state, player))
+
+    def _terminal_value(self, state, player):
+        '''the value of a position where the round is over, or None if it isn't'''
+        charges = state.charges
+        if charges[player] <= 0:
+            return 0.0
+        if len(charges) == 2:
+            if charges[1 - player] <= 0:
+                return 1.0
+        elif sum(c > 0 for c in charges) == 1:
+            return 1.0
+        if state.round is None:
+            return 0.0 if self.round_end is None else self.round_end(state, player)
+        return None
+
+    def value(self, state, player, alpha=0.0, beta=1.0, depth=1):
+        trace = self.trace
+        terminal_value = self._terminal_value(state, player)
+        if terminal_value is not None:
+            if trace is not None:
+                trace.terminal_hits += 1
+            return terminal_value
+        if self.tablebase is not None:
+            value = self.tablebase.get(state, player)
+            if value is not None:
+                if trace is not None:
+                    trace.tablebase_hits += 1
+                return value
+
+        hint = None
+        key = position_key(state, player)
+        if self.max_depth is not None:
+            entry = self.exact_table.get(key)
+            if entry is not None and entry[0] == entry[1]:
+                if trace is not None:
+                    trace.cache_hits += 1
+                return entry[0]
+            if depth > self.max_depth:
+                self.leaves_cut_off += 1
+                return heuristic_value(state, player)
+            if not self.nodes_searched % _DEADLINE_CHECK_INTERVAL and monotonic() >= self.deadline:
+                raise _OutOfTime()
+            hint = self.hints.get(key)
+            exact_key = key
+            key = (key, self.max_depth - depth)
+        entry = self.table.get(key)
+        if entry is None and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                if trace is not None:
+                    trace.store_hits += 1
+                self.table.put(key, (value, value, None))
+                return value
+        lower, upper, best_move = entry or (0.0, 1.0, hint)
+        if lower == upper or lower >= beta or upper <= alpha:
+            if trace is not None:
+                trace.cache_hits += 1
+            if key in self.estimates:
+                self.leaves_cut_off += 1
+            return lower if lower == upper or lower >= beta else upper
+        alpha = max(alpha, lower)
+        beta = min(beta, upper)
+        seats = canonical_seats(state, player)
+        best_move = _reseated(best_move, seats)
+
+        self.nodes_searched += 1
+        leaves_cut_off = self.leaves_cut_off
+        if trace is None:
+            value, best_move = self._search(state, player, alpha, beta, depth, best_move)
+        else:
+            started = trace.enter()
+            value, best_move, num_moves = self._search(state, player, alpha, beta, depth, best_move, count_moves=True)
+            trace.leave(depth, num_moves, started)
+
+        # outside the bounds, the value is only a bound itself
+        if value <= alpha:
+            upper = value
+        elif value >= beta:
+            lower = value
+        else:
+            lower = upper = value
+        # a bound of 0 or 1 pins the value too, and wins and losses are the
+        # positions most worth saving (there's no store while deepening)
+        if lower == upper and self.store is not None:
+            self.store.put(key, value)
+        if self.max_depth is not None:
+            if self.leaves_cut_off > leaves_cut_off:
+                self.estimates.add(key)
+            elif lower == upper:
+                # solved to the end of the round, so it's exact at any depth
+                self.exact_table.put(exact_key, (value, value, _unseated(best_move, seats)))
+                return value
+        self.table.put(key, (lower, upper, _unseated(best_move, seats)))
+        return value
+
+    def _search(self, state, player, alpha, beta, depth, best_move=None, count_moves=False):
+        mover = state.round.turn
+        is_maximizing = mover == player
+        best_value = 0.0 if is_maximizing else 1.0
+        moves = order_moves(state, legal_moves(state, prune=self.prune), best_move)
+        for move in moves:
+            if is_maximizing:
+                value = self._expectation(state, move, player, max(alpha, best_value), beta, depth)
+                if value > best_value or best_move is None:
+                    best_value, best_move = value, move
+                if best_value >= beta:
+                    break
+            else:
+                value = self._expectation(state, move, player, alpha, min(beta, best_value), depth)
+                if value < best_value or best_move is None:
+                    best_value, best_move = value, move
+                if best_value <= alpha:
+                    break
+        if count_moves:
+            return best_value, best_move, len(moves)
+        return best_value, best_move
+
+    def _expectation(self, state, move, player, alpha, beta, depth):
+        expected_value = 0.0
+        remaining_chance = 1.0
+        for chance, child in outcomes(state, move):
+            remaining_chance -= chance
+
+            # the bounds this outcome's value must fall within for the expectation to fall within ours
+            child_alpha = (alpha - expected_value - remaining_chance) / chance
+            child_beta = (beta - expected_value) / chance
+            # a bound is clamped to the one it failed, which it can only
+            # miss by rounding, so it's never mistaken for an exact value
+            if child_alpha >= 1.0:
+                return min(alpha, expected_value + chance + remaining_chance)
+            if child_beta <= 0.0:
+                return max(beta, expected_value)
+
+            if self.trace is None:
+                value = self.value(child, player, max(0.0, child_alpha), min(1.0, child_beta), depth=depth+1)
+            else:
+                self.trace.path.append(f"{state.player_names[state.round.turn]} {move.describe(state)}")
+                value = self.value(child, player, max(0.0, child_alpha), min(1.0, child_beta), depth=depth+1)
+                self.trace.path.pop()
+            expected_value += chance * value
+            if value <= child_alpha:
+                return min(alpha, expected_value + max(0.0, remaining_chance))
+            if value >= child_beta:
+                return max(beta, expected_value)
+        return expected_value
+
+    def parallel_value(self, state, player, workers):
+        '''
+        value of state, with the positions split_depth moves away solved in
+        parallel
+
+        the tree above those positions is expanded here without bounds, the
+        frontier positions are solved by worker processes, and the values
+        are combined in the same order as the serial search, so the result is
+        exactly the same.
+        '''
+        frontier = {}
+        self._expand(state, player, self.split_depth, frontier)
+        keys = list(frontier)
+        store_path = None if self.store is None else self.store.path
+        initargs = (self.prune, store_path, self.tablebase)
+        # multiprocessing takes a while to import, and most searches don't need it
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            values = pool.map(_solve_in_worker, [frontier[key] for key in keys], repeat(player))
+            for key, value in zip(keys, values):
+                self.table.put(key, (value, value, None))
+        return self._combine(state, player, self.split_depth)
+
+    def _expand(self, state, player, split_depth, frontier):
+        if self._terminal_value(state, player) is not None:
+            return
+        if split_depth == 0:
+            frontier[position_key(state, player)] = state
+            return
+        for move in legal_moves(state, prune=self.prune):
+            for _, child in outcomes(state, move):
+                self._expand(child, player, split_depth - 1, frontier)
+
+    def _combine(self, state, player, split_depth):
+        terminal_value = self._terminal_value(state, player)
+        if terminal_value is not None:
+            return terminal_value
+        key = position_key(state, player)
+        if split_depth == 0:
+            return self.table.get(key)[0]
+
+        is_maximizing = state.round.turn == player
+        best_value, best_move = None, None
+        for move in order_moves(state, legal_moves(state, prune=self.prune)):
+            value = 0.0
+            for chance, child in outcomes(state, move):
+                value += chance * self._combine(child, player, split_depth - 1)
+            if best_value is None or (value > best_value if is_maximizing else value < best_value):
+                best_value, best_move = value, move
+        self.table.put(key, (best_value, best_value, _unseated(best_move, canonical_seats(state, player))))
+        if self.store is not None:
+            self.store.put(key, best_value)
+        return best_value
+
+
+def _reseated(move, seats):
+    '''a best move from the table, in the seating of the position it's for'''
+    if move is None or seats is None:
+        return move
+    return move.reseat(seats)
+
+def _unseated(move, seats):
+    '''a best move in the canonical seating, for the table'''
+    if move is None or seats is None:
+        return move
+    return move.reseat({seat: i for i, seat in enumerate(seats)})
+
+
+default_solver = Solver()
+
+# each worker process solves its share of the frontier with its own solver
+_worker_solver = None
+
+def _init_worker(prune, store_path, tablebase):
+    global _worker_solver
+    store = None
+    if store_path is not None:
+        from position_store import PositionStore
+        store = PositionStore(store_path)
+    _worker_solver = Solver(prune=prune, store=store, tablebase=tablebase)
+
+def _solve_in_worker(state, player):
+    value = _worker_solver.value(state, player)
+    if _worker_solver.store is not None:
+        _worker_solver.store.flush()
+    return value
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import struct
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from itertools import product
+
+from packed_state import PackedPhase, PackedRound
+
+MAGIC = b"BRTB"
+FORMAT_VERSION = 1
+
+# magic, format version, rules version, max shells, max charges, number of positions
+HEADER = struct.Struct("<4sIIIIQ")
+
+PLAYER_NAMES = ("player", "dealer")
+
+
+def pack_position(state, player, max_shells, max_charges):
+    '''
+    the position as a single int, or None if it's not in a tablebase built
+    with max_shells and max_charges
+
+    only two-player positions without items are covered. shells are counted
+    from the current one, so the history of the round doesn't matter.
+    '''
+    round = state.round
+    if (
+        len(state.charges) != 2
+        or any(state.items)
+        or round.current_shell_inverted
+        or round.remaining_shells() > max_shells
+        or state.max_charges > max_charges
+        or state.critical_charges > 15
+    ):
+        return None
+    future = round.future_shell_mask()
+    fields = (
+        (player, 1),
+        (state.max_charges, 4),
+        (state.critical_charges, 4),
+        (state.charges[0], 4),
+        (state.charges[1], 4),
+        (state.critical, 2),
+        (round.remaining_live_shells(), 4),
+        (round.remaining_blank_shells(), 4),
+        ((round.known_live_shells & future) >> round.num_past_shells, 8),
+        ((round.known_blank_shells & future) >> round.num_past_shells, 8),
+        (round.gun_is_sawed, 1),
+        (round.handcuffed, 2),
+        (round.turn, 1),
+    )
+    packed = 0
+    for value, num_bits in fields:
+        packed = packed << num_bits | int(value)
+    return packed
+
+
+class Tablebase:
+    '''
+    win probabilities of every itemless position with at most max_shells
+    shells left, loaded from a file made by generate
+
+    the file is a header followed by the sorted packed positions (uint64)
+    and their values (float64), so lookups are a binary search.
+    '''
+
+    def __init__(self, keys, values, max_shells, max_charges, rules_version):
+        self.keys = keys
+        self.values = values
+        self.max_shells = max_shells
+        self.max_charges = max_charges
+        self.rules_version = rules_version
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __str__(self):
+        return f"{self.hits} hits, {len(self)} positions up to {self.max_shells} shells and {self.max_charges} charges"
+
+    def get(self, state, player):
+        packed = pack_position(state, player, self.max_shells, self.max_charges)
+        if packed is None:
+            return None
+        i = bisect_left(self.keys, packed)
+        if i == len(self.keys) or self.keys[i] != packed:
+            return None
+        self.hits += 1
+        return self.values[i]
+
+    @classmethod
+    def load(cls, path, rules_version=None):
+        if rules_version is None:
+            from solver import RULES_VERSION as rules_version
+        with open(path, "rb") as f:
+            magic, format_version, file_rules_version, max_shells, max_charges, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or format_version != FORMAT_VERSION:
+                raise ValueError(f"{path} isn't a tablebase")
+            if file_rules_version != rules_version:
+                raise ValueError(f"{path} was built for rules version {file_rules_version}, not {rules_version}")
+            keys = array("Q")
+            keys.fromfile(f, count)
+            values = array("d")
+            values.fromfile(f, count)
+        return cls(keys, values, max_shells, max_charges, rules_version)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.rules_version, self.max_shells, self.max_charges, len(self)))
+            self.keys.tofile(f)
+            self.values.tofile(f)
+
+
+def shell_patterns(num_shells, num_live_shells):
+    '''every way to know some of num_shells shells, as (known live, known blank) bitmasks'''
+    num_blank_shells = num_shells - num_live_shells
+    for pattern in product((None, True, False), repeat=num_shells):
+        if pattern.count(True) > num_live_shells or pattern.count(False) > num_blank_shells:
+            continue
+        known_live_shells = sum(1 << i for i, is_live in enumerate(pattern) if is_live is True)
+        known_blank_shells = sum(1 << i for i, is_live in enumerate(pattern) if is_live is False)
+        yield known_live_shells, known_blank_shells
+
+
+def positions(max_shells, max_charges, critical_charges=(0,)):
+    '''every itemless position up to max_shells shells and max_charges, fewest shells first'''
+    for num_shells in range(1, max_shells + 1):
+        for num_live_shells in range(num_shells + 1):
+            for known_live_shells, known_blank_shells in shell_patterns(num_shells, num_live_shells):
+                for phase_charges in range(1, max_charges + 1):
+                    for phase_critical_charges in sorted(set(c for c in critical_charges if c < phase_charges)):
+                        for charges in product(range(1, phase_charges + 1), repeat=2):
+                            # players only go critical by dropping to critical_charges, and can't heal out of it
+                            critical = sum(1 << i for i, c in enumerate(charges) if c <= phase_critical_charges)
+                            for turn, gun_is_sawed, other_is_cuffed in product((0, 1), (False, True), (False, True)):
+                                yield PackedPhase(
+                                    player_names=PLAYER_NAMES,
+                                    charges=charges,
+                                    max_charges=phase_charges,
+                                    critical_charges=phase_critical_charges,
+                                    critical=critical,
+                                    items=((), ()),
+                                    round=PackedRound(
+                                        total_live_shells=num_live_shells,
+                                        total_blank_shells=num_shells - num_live_shells,
+                                        known_live_shells=known_live_shells,
+                                        known_blank_shells=known_blank_shells,
+                                        turn=turn,
+                                        gun_is_sawed=gun_is_sawed,
+                                        handcuffed=(1 << (1 - turn)) if other_is_cuffed else 0,
+                                    ),
+                                )
+
+
+def generate(max_shells, max_charges, critical_charges=(0,)):
+    '''
+    solve every position in the tablebase
+
+    positions with fewer shells are solved first, so every position after
+    them finds its successors already solved in the solver's table
+    '''
+    from solver import RULES_VERSION, Solver, TranspositionTable
+    solver = Solver(table=TranspositionTable(max_size=None))
+    solved = {}
+    for state in positions(max_shells, max_charges, critical_charges):
+        for player in range(2):
+            packed = pack_position(state, player, max_shells, max_charges)
+            solved[packed] = solver.value(state, player)
+    keys = array("Q", sorted(solved))
+    values = array("d", (solved[key] for key in keys))
+    return Tablebase(keys, values, max_shells, max_charges, RULES_VERSION)
+
+
+def parse_args():
+    parser = ArgumentParser(description="build an endgame tablebase")
+    parser.add_argument("OUTFILE")
+    parser.add_argument("--max-shells", type=int, default=4)
+    parser.add_argument("--max-charges", type=int, default=4)
+    parser.add_argument("--critical-charges", type=int, nargs="+", default=[0])
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not 1 <= args.max_shells <= 8 or not 1 <= args.max_charges <= 15:
+        raise SystemExit("rounds have 1 to 8 shells, and charges must fit in 4 bits")
+    tablebase = generate(args.max_shells, args.max_charges, args.critical_charges)
+    tablebase.save(args.OUTFILE)
+    print(len(tablebase), "positions saved to", args.OUTFILE)
@@ -1,6 +1,14 @@
 #!/bin/sh
 set -e
 
+tmp=$(mktemp -d)
+trap 'rm -rf "$tmp"' EXIT
+
+fail() {
+    echo "test failed: $*"
+    exit 1
+}
+
 for f in example_logs/*.*; do
     python3 parse_log.py "$f"
 done
@@ -9,9 +17,94 @@ for f in example_logs/errors/**/*.*; do
     echo
     if python3 parse_log.py "$f"; then
         echo test failed: expected error!
+        exit 1
     fi
 done
 
+# validating without answering queries has to reject the same logs
+echo
+python3 validate_corpus.py example_logs > /dev/null
+
+# a log parsed again after more lines are appended resumes from a
+# checkpoint, and answers the queries after it as a cold run does
+awk '{ print } / loads / { print "!check player odds" }' example_logs/Game_track.buckshot > "$tmp/full.buckshot"
+head -n 120 "$tmp/full.buckshot" > "$tmp/game.buckshot"
+python3 parse_log.py --checkpoints "$tmp/checkpoints.sqlite" "$tmp/game.buckshot" > /dev/null 2>&1
+tail -n +121 "$tmp/full.buckshot" >> "$tmp/game.buckshot"
+python3 parse_log.py --checkpoints "$tmp/checkpoints.sqlite" "$tmp/game.buckshot" > "$tmp/resumed.txt" 2> "$tmp/resumed.err"
+python3 parse_log.py "$tmp/full.buckshot" > "$tmp/cold_game.txt" 2> /dev/null
+grep -q "resumed after line [1-9]" "$tmp/resumed.err" || fail "parsing didn't resume from a checkpoint"
+grep -q "game.buckshot ok" "$tmp/resumed.err" || fail "the resumed log didn't validate"
+[ -s "$tmp/resumed.txt" ] || fail "no queries were answered after resuming"
+tail -n "$(wc -l < "$tmp/resumed.txt")" "$tmp/cold_game.txt" | diff - "$tmp/resumed.txt" || fail "resuming changed the answers"
+
+# logs written as binary replays and read back keep their events, and
+# the state at every line (through the round index) matches the parser's
+python3 replay.py check example_logs/*.* example_logs/*/*.*
+
+# a scripted client session with the analysis server, errors included
+python3 server.py serve --socket "$tmp/server.sock" 2> "$tmp/server.err" &
+server_pid=$!
+for i in $(seq 50); do
+    [ -S "$tmp/server.sock" ] && break
+    sleep 0.1
+done
+python3 server.py send --socket "$tmp/server.sock" > "$tmp/responses.txt" <<'REQUESTS'
+{"op": "append", "session": "s", "lines": ["phase I, 1 charge", "round I.1", "player gets glass", "dealer loads 1 live, 1 blank", "player uses glass, sees live; !check player odds"]}
+{"op": "odds", "session": "s", "player": "player"}
+{"op": "odds", "session": "s", "player": "dealer", "time_budget": 0.5}
+{"op": "state", "session": "s"}
+{"op": "append", "session": "s", "lines": ["dealer shoots player, live"]}
+{"op": "append", "session": "s", "lines": 5}
+{"op": "odds", "session": "nope"}
+{"op": "odds", "session": "s", "time_budget": -1}
+not json
+{"op": "frobnicate"}
+{"op": "stats"}
+{"op": "close", "session": "s"}
+{"op": "state", "session": "s"}
+REQUESTS
+kill "$server_pid"
+cat > "$tmp/expected.txt" <<'RESPONSES'
+{"ok": true, "lines": 5}
+{"ok": true, "odds": 1.0, "search": "exact", "seconds": _}
+{"ok": true, "odds": 0.0, "search": "exact (solved in 1 moves)", "seconds": _}
+{"ok": true, "lines": 5, "winner": null, "phase": {"players": {"player": {"charges": 1, "items": []}, "dealer": {"charges": 1, "items": []}}, "turn": "player", "live_shells": 1, "blank_shells": 1}}
+{"ok": false, "error": "not your turn", "line": 6}
+{"ok": false, "error": "lines must be a list of strings"}
+{"ok": false, "error": "no such session nope"}
+{"ok": false, "error": "time_budget must be a positive number of seconds"}
+{"ok": false, "error": "Expecting value: line 1 column 1 (char 0)"}
+{"ok": false, "error": "no such op frobnicate"}
+{"ok": true, "sessions": 1, "requests": 10, "odds_queries": 2, "solver_cache": _}
+{"ok": true}
+{"ok": false, "error": "no such session s"}
+RESPONSES
+sed -e 's/"seconds": [^,}]*/"seconds": _/' -e 's/"solver_cache": "[^"]*"/"solver_cache": _/' "$tmp/responses.txt" |
+    diff "$tmp/expected.txt" - || fail "the server's responses changed"
+
+echo
+python3 benchmark.py --check-warm-deepening
+
+# runs that only parse (a log with no odds queries) never import the solver
+echo
+python3 bench_parse.py --startup example_logs/Game_track.buckshot --runs 3
+
+# odds read back from a warm cache match the ones solved cold
+python3 parse_log.py --cache "$tmp/cache.sqlite" example_logs/odds_with_items.buckshot > "$tmp/cold.txt"
+python3 parse_log.py --cache "$tmp/cache.sqlite" example_logs/odds_with_items.buckshot > "$tmp/warm.txt" 2> "$tmp/warm.err"
+diff "$tmp/cold.txt" "$tmp/warm.txt" || fail "odds changed when read from the cache"
+python3 position_store.py "$tmp/cache.sqlite" info | grep -q "(current): [1-9]" || fail "nothing was saved to the cache"
+grep "saved positions:" "$tmp/warm.err" | tail -n 1 | grep -q " 0 misses" || fail "the warm run had to solve positions again"
+
+# a policy table, saved and loaded back, agrees with the solver everywhere
+python3 policy_table.py "$tmp/policy.bin" --live 1 2 --blank 1 2 --player-items glass knife --dealer-items beer --check
+
+# every engine has to agree with the reference rules on the logs, and on a
+# short run of random games
+python3 fuzz.py example_logs/*.* example_logs/*/*.* example_logs/errors/**/*.*
+python3 fuzz.py --cases 200 --seed 1 --out fuzz_failures
+
 echo
 echo =================
 echo all tests passed!
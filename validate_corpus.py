@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from pathlib import Path
+from sys import exit, stderr
+from time import perf_counter
+
+import parse_log
+from exceptions import GameError
+from game_state import GameState
+from parse_log import LogParseError, parse_line
+
+
+def find_logfiles(patterns):
+    '''every .buckshot file in or matching the given directories, files and globs'''
+    paths = set()
+    for pattern in patterns:
+        for match in glob(pattern, recursive=True) or [pattern]:
+            path = Path(match)
+            if path.is_dir():
+                paths.update(path.rglob("*.buckshot"))
+            else:
+                paths.add(path)
+    return sorted(paths)
+
+
+def expects_error(path):
+    '''logs in an errors directory (like example_logs/errors/) must fail to validate'''
+    return "errors" in Path(path).parent.parts
+
+
+def validate_logfile(path):
+    '''validate one log, returning a report record instead of printing'''
+    record = {
+        "file": str(path),
+        "status": "ok",
+        "line": None,
+        "text": None,
+        "error": None,
+        "message": None,
+    }
+    start = perf_counter()
+    game_state = GameState(player_names=["player", "dealer"])
+    with open(path) as f:
+        for i, line in enumerate(f):
+            try:
+                game_state = parse_line(game_state, line)
+            except Exception as e:
+                known_error = isinstance(e, LogParseError) or isinstance(e, GameError)
+                record.update(
+                    status="failed" if known_error else "crashed",
+                    line=i + 1,
+                    text=line.strip(),
+                    error=type(e).__name__,
+                    message=str(e),
+                )
+                break
+    record["seconds"] = perf_counter() - start
+    record["expected"] = "failed" if expects_error(path) else "ok"
+    return record
+
+
+def _init_worker():
+    '''
+    check odds queries without solving them (see parse_log.py
+    --validate-only), and keep anything else the parser prints out of the
+    report
+    '''
+    parse_log.validate_only = True
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+
+def validate_corpus(paths, workers=None):
+    '''validate logs in a process pool, yielding report records as they finish'''
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(validate_logfile, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def parse_args():
+    parser = ArgumentParser(description="validate many logs at once, reporting JSON lines")
+    parser.add_argument("PATH", nargs="+", help="log files, directories of them, or globs")
+    parser.add_argument("--workers", type=int, default=None, help="processes to validate with (default: one per core)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = find_logfiles(args.PATH)
+    num_unexpected = 0
+    for record in validate_corpus(paths, args.workers):
+        print(json.dumps(record), flush=True)
+        if record["status"] != record["expected"]:
+            num_unexpected += 1
+            print(f"{record["file"]}: expected {record["expected"]}, got {record["status"]}", file=stderr)
+    print(f"{len(paths)} logs, {num_unexpected} unexpected results", file=stderr)
+    if num_unexpected:
+        exit(1)